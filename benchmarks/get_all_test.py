@@ -0,0 +1,78 @@
+import asyncio
+import tracemalloc
+from dataclasses import dataclass
+from itertools import count
+
+from cacheme import Cache, Node, Storage, get_all, register_storage
+
+BATCH = 1000
+_counter = count()
+
+
+@dataclass
+class BatchNode(Node):
+    uid: int
+
+    def key(self) -> str:
+        return f"uid:{self.uid}"
+
+    @classmethod
+    async def load_all(cls, nodes):
+        return [(node, node.uid) for node in nodes]
+
+    class Meta(Node.Meta):
+        version = "v1"
+        caches = [Cache(storage="bench-local", ttl=None)]
+
+
+def _new_batch():
+    start = next(_counter) * BATCH
+    return [BatchNode(uid=start + i) for i in range(BATCH)]
+
+
+# peak traced memory of one get_all call
+def _peak_memory(loop, nodes) -> int:
+    tracemalloc.start()
+    loop.run_until_complete(get_all(nodes))
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak
+
+
+def _setup_loop():
+    loop = asyncio.events.new_event_loop()
+    asyncio.events.set_event_loop(loop)
+    loop.run_until_complete(
+        register_storage("bench-local", Storage(url="local://lru", size=BATCH * 200))
+    )
+    return loop
+
+
+def _teardown_loop(loop):
+    asyncio.events.set_event_loop(None)
+    loop.close()
+
+
+# 1k nodes, all hit in local cache
+def test_get_all_hit(benchmark):
+    loop = _setup_loop()
+    nodes = _new_batch()
+    loop.run_until_complete(get_all(nodes))
+    benchmark.extra_info["peak_bytes"] = _peak_memory(loop, nodes)
+    benchmark.pedantic(
+        lambda: loop.run_until_complete(get_all(nodes)), rounds=100, iterations=1
+    )
+    _teardown_loop(loop)
+
+
+# 1k nodes, all miss, load with load_all and fill local cache
+def test_get_all_miss(benchmark):
+    loop = _setup_loop()
+    benchmark.extra_info["peak_bytes"] = _peak_memory(loop, _new_batch())
+    benchmark.pedantic(
+        lambda nodes: loop.run_until_complete(get_all(nodes)),
+        setup=lambda: ((_new_batch(),), {}),
+        rounds=100,
+        iterations=1,
+    )
+    _teardown_loop(loop)
@@ -0,0 +1,44 @@
+import asyncio
+from dataclasses import dataclass
+
+from cacheme import Cache, Node, Storage, get, register_storage
+
+COUNT = 1000
+
+
+@dataclass
+class HitNode(Node):
+    uid: int
+
+    def key(self) -> str:
+        return f"uid:{self.uid}"
+
+    async def load(self) -> int:
+        return self.uid
+
+    class Meta(Node.Meta):
+        version = "v1"
+        caches = [Cache(storage="bench-hit", ttl=None)]
+
+
+async def _get_many(nodes):
+    for node in nodes:
+        await get(node)
+
+
+# 1k gets, all hit on first local cache
+def test_get_local_hit(benchmark):
+    loop = asyncio.events.new_event_loop()
+    asyncio.events.set_event_loop(loop)
+    loop.run_until_complete(
+        register_storage("bench-hit", Storage(url="local://tlfu", size=COUNT * 2))
+    )
+    loop.run_until_complete(_get_many([HitNode(uid=i) for i in range(COUNT)]))
+    benchmark.pedantic(
+        lambda nodes: loop.run_until_complete(_get_many(nodes)),
+        setup=lambda: (([HitNode(uid=i) for i in range(COUNT)],), {}),
+        rounds=100,
+        iterations=1,
+    )
+    asyncio.events.set_event_loop(None)
+    loop.close()
@@ -0,0 +1,54 @@
+from dataclasses import dataclass
+
+from cacheme.models import Node
+
+COUNT = 1000
+
+
+@dataclass
+class CustomKeyNode(Node):
+    user_id: int
+    foo_id: str
+
+    def key(self) -> str:
+        return f"user:{self.user_id}:foo:{self.foo_id}"
+
+    class Meta(Node.Meta):
+        version = "v1"
+
+
+@dataclass
+class FieldsKeyNode(Node):
+    user_id: int
+    foo_id: str
+
+    class Meta(Node.Meta):
+        version = "v1"
+        key_fields = ["user_id", "foo_id"]
+
+
+def test_full_key_custom(benchmark):
+    def run():
+        for i in range(COUNT):
+            CustomKeyNode(user_id=i, foo_id="foo").full_key()
+
+    benchmark(run)
+
+
+def test_full_key_fields(benchmark):
+    def run():
+        for i in range(COUNT):
+            FieldsKeyNode(user_id=i, foo_id="foo").full_key()
+
+    benchmark(run)
+
+
+# get calls full_key several times on one node
+def test_full_key_repeated(benchmark):
+    node = CustomKeyNode(user_id=1, foo_id="foo")
+
+    def run():
+        for _ in range(COUNT):
+            node.full_key()
+
+    benchmark(run)
@@ -1,7 +1,13 @@
 from theine import BloomFilter
 
-from cacheme.core import (Memoize, build_node, get, get_all, invalidate, nodes,
-                          refresh, stats)
+from cacheme.core import (Memoize, MemoizeAll, build_node, drain, get, get_all,
+                          get_all_nowait, get_nowait, invalidate, iter_all,
+                          nodes, refresh, set_negative_cache, set_singleflight,
+                          stats)
 from cacheme.data import register_storage
-from cacheme.models import Cache, DynamicNode, Node, set_prefix
+from cacheme.models import (Cache, DynamicNode, Node, set_metrics_backend,
+                            set_prefix)
+from cacheme.sampler import Sampler, set_sampler
 from cacheme.storages import Storage
+from cacheme.tracing import set_tracer
+from cacheme.utils import set_executor
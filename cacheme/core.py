@@ -1,39 +1,77 @@
-from asyncio import Event, Future
-from collections import OrderedDict
-from functools import update_wrapper
+from asyncio import (
+    AbstractEventLoop,
+    Event,
+    Future,
+    Task,
+    _get_running_loop,
+    ensure_future,
+    gather,
+    get_running_loop,
+    sleep,
+)
+from copy import copy
+from datetime import datetime, timedelta, timezone
+from functools import partial, update_wrapper
+from math import log
+from random import random
 from time import time_ns
+from uuid import uuid4
+from weakref import WeakKeyDictionary
 from typing import (
     Any,
+    AsyncIterable,
+    AsyncIterator,
     Awaitable,
     Callable,
     Dict,
     Iterable,
     List,
+    Mapping,
+    NoReturn,
     Optional,
     Sequence,
+    Set,
     Tuple,
     Type,
     TypeVar,
+    Union,
     cast,
     overload,
 )
 
-from typing_extensions import ParamSpec, Protocol
-
-from cacheme.interfaces import DoorKeeper, Metrics, Serializer, Node
+from typing_extensions import Concatenate, ParamSpec, Protocol
+
+from cacheme import models, sampler, tracing
+from cacheme.data import list_storages
+from cacheme.interfaces import (
+    CachedData,
+    DoorKeeper,
+    Metrics,
+    MetricsShard,
+    Node,
+    Serializer,
+    Storage,
+    Tracer,
+)
 from cacheme.models import (
     Cache,
     DynamicNode,
-    Fetcher,
+    Plan,
     _add_node,
     get_nodes,
+    get_plan,
+    new_metrics,
     sentinel,
 )
+from cacheme.singleflight import SingleFlight
+from cacheme.utils import to_async
 
 
 P = ParamSpec("P")
 R = TypeVar("R", covariant=True)
 N = TypeVar("N", bound=Node)
+K = TypeVar("K")
+V = TypeVar("V")
 
 
 class Locker:
@@ -45,13 +83,50 @@ class Locker:
         self.value = None
 
 
-_awaits: Dict[str, Future] = {}
+_awaits = SingleFlight()
+# strong references to background refresh tasks, avoid task being garbage collected
+_tasks: Set[Task] = set()
+# load failures cached by key, value is (expire time in ns, exception)
+_negatives: Dict[str, Tuple[int, BaseException]] = {}
+_negatives_max_size = 10000
+# gets waiting to be loaded together, grouped by event loop and node class
+_Batch = Dict[Type[Node], Dict[str, Tuple[Node, Future]]]
+# quoted, WeakKeyDictionary is not subscriptable before python 3.9
+_batches: "WeakKeyDictionary[AbstractEventLoop, _Batch]" = WeakKeyDictionary()
 
 
 def _awaits_len():
     return len(_awaits)
 
 
+def _awaits_oldest() -> Optional[timedelta]:
+    return _awaits.oldest()
+
+
+def set_negative_cache(max_size: int = 10000):
+    """
+    Configure load failure cache of nodes with Meta.negative_ttl.
+
+    :param max_size: max cached failures, expired ones are removed when full,
+        all are cleared if still full.
+    """
+    global _negatives_max_size
+    _negatives_max_size = max_size
+
+
+def set_singleflight(
+    max_size: Optional[int] = None, timeout: Optional[timedelta] = None
+):
+    """
+    Configure in-flight load sharing.
+
+    :param max_size: max in-flight keys of each event loop, loads exceeding it won't be shared.
+    :param timeout: waiters of a load not finished in time get TimeoutError.
+    """
+    _awaits.max_size = max_size
+    _awaits.timeout = timeout
+
+
 @overload
 async def get(node: Node[R]) -> R:
     ...
@@ -62,206 +137,842 @@ async def get(node: N, load_fn: Callable[[N], Awaitable[R]]) -> R:
     ...
 
 
-async def get(node: Node, load_fn=None):
+async def get(node: Node, load_fn=None, _traced: bool = False):
     """
     Get data from node. Will call load function if cahce miss.
 
     :param node: node instance to get data.
     :param load_fn: override load function, which will be called instead of node load function if set.
     """
-    metrics = node.Meta.metrics
+    tracer = tracing._tracer
+    # _traced is set by the get span wrapper below, untraced path stays inline
+    if tracer is not None and not _traced:
+        # stage spans are nested in get span
+        return await tracing.trace(
+            tracer,
+            tracing.GET,
+            node.__class__,
+            node.full_key(),
+            None,
+            get(node, load_fn, True),  # type: ignore
+        )
     result = sentinel
-    caches = node.Meta.caches
-    local_caches: List[Cache] = []
-    remote_caches: List[Cache] = []
+    plan = get_plan(node.Meta)
     miss: List[Cache] = []
-
-    for cache in caches:
-        if cache.is_local:
-            local_caches.append(cache)
+    if sampler._sampler is not None:
+        sampler._sampler.record_get(node.__class__, node.full_key())
+
+    # try get cached data from local storages first, metrics are counted after lookup
+    for cache in plan.local:
+        if tracer is not None:
+            result = tracing.trace_sync(
+                tracer,
+                tracing.LOCAL,
+                node.__class__,
+                node.full_key(),
+                cache._storage_name,
+                _get_local,
+                node,
+                cache,
+                load_fn,
+            )
+        elif not cache.revalidate:
+            result = cache.storage.get_sync(node, None)
         else:
-            remote_caches.append(cache)
-
-    # try get cached data from local storages first
-    for cache in local_caches:
-        result = cache.storage.get_sync(node, None)
+            result = _get_local(node, cache, load_fn)
         if result is not sentinel:
-            metrics._hit_count += 1
-            # return fast if hit on first local cache
-            if not miss:
-                return result
             break
         miss.append(cache)
 
+    # inlined Metrics.shard/MetricsShard.local_layers, keep local hit path cheap
+    try:
+        metrics = node.Meta.metrics._local.shard
+    except AttributeError:
+        metrics = node.Meta.metrics.shard()
+    if miss or result is not sentinel:
+        if metrics._plan is plan:
+            layers = metrics._local_layers
+        else:
+            layers = metrics.local_layers(plan)
+        # return fast if hit on first local cache
+        if not miss:
+            metrics._hit_count += 1
+            layers[0]._hit_count += 1
+            return result
+        for layer in layers[: len(miss)]:
+            layer._miss_count += 1
+        if result is not sentinel:
+            metrics._hit_count += 1
+            layers[len(miss)]._hit_count += 1
+
     # can't find cached result in any local storage, try load from remote storage
     # remote storages are slow and asynchronous, use tmp cached awaitables to avoid thundering herd
+    key = None
     if result is sentinel:
         key = node.full_key()
-        future = _awaits.get(key, None)
+        negative_ttl = node.Meta.negative_ttl
+        if negative_ttl is not None:
+            error = _get_negative(key)
+            if error is not None:
+                metrics._hit_count += 1
+                _raise_negative(error)
+        future = _awaits.get(key)
         if future is None:
             metrics._miss_count += 1
-            future = Future()
-            _awaits[node.full_key()] = future
+            future = _awaits.start(key)
+            window = node.Meta.batch_window
+            if window is not None and load_fn is None and plan.lease is None:
+                _add_to_batch(node, key, future, window)
+                if tracer is not None:
+                    return await tracing.trace(
+                        tracer, tracing.BATCH, node.__class__, key, None, future
+                    )
+                return await future
             now = time_ns()
             try:
-                result = await _load_from_caches(node, remote_caches, miss, load_fn)
+                result = await _load_from_caches(node, plan, miss, load_fn, tracer)
             except Exception as e:
                 metrics._load_failure_count += 1
-                metrics._total_load_time += time_ns() - now
-                _awaits.pop(node.full_key(), None)
+                _record_load(metrics, time_ns() - now)
+                _awaits.remove(key, future)
+                if negative_ttl is not None:
+                    _set_negative(key, e, negative_ttl)
+                _awaits.set_exception(future, e)
                 raise (e)
             metrics._load_success_count += 1
-            metrics._total_load_time += time_ns() - now
-            future.set_result(result)
+            _record_load(metrics, time_ns() - now)
+            _awaits.set_result(future, result)
         else:
             metrics._hit_count += 1
-            result = await future
-
-    # fill missing caches
-    for cache in miss:
-        await cache.storage.set(node, result, cache.ttl, node.Meta.serializer)
-    # remove from tmp cache after fill
-    _awaits.pop(node.full_key(), None)
+            # singleflight leader fills caches
+            if tracer is not None:
+                return await tracing.trace(
+                    tracer, tracing.SINGLEFLIGHT, node.__class__, key, None, future
+                )
+            return await future
+
+    # fill missing caches, remove from tmp cache after fill even if fill failed
+    try:
+        for cache in miss:
+            if cache.write_behind and cache.storage.set_later(
+                node, result, cache.ttl, node.Meta.serializer
+            ):
+                continue
+            fill = cache.storage.set(node, result, cache.ttl, node.Meta.serializer)
+            if tracer is not None:
+                fill = tracing.trace(
+                    tracer,
+                    tracing.FILL,
+                    node.__class__,
+                    node.full_key(),
+                    cache._storage_name,
+                    fill,
+                )
+            if cache.is_local:
+                await fill
+                continue
+            now = time_ns()
+            await fill
+            metrics.layer(cache._storage_name)._set_latency.record(time_ns() - now)
+    finally:
+        if key is not None:
+            _awaits.remove(key, cast(Future, future))
 
     return result
 
 
+def get_nowait(node: Node[R], default: Any = sentinel) -> Any:
+    """
+    Get data from node local caches synchronously, without loading or touching event loop.
+
+    :param node: node instance to get data.
+    :param default: returned if data not found in any local cache, default is sentinel.
+    """
+    plan = get_plan(node.Meta)
+    if sampler._sampler is not None:
+        sampler._sampler.record_get(node.__class__, node.full_key())
+    metrics = node.Meta.metrics.shard()
+    for cache, layer in zip(plan.local, metrics.local_layers(plan)):
+        # stale data is refreshed in background only if called in event loop
+        if cache.revalidate and _get_running_loop() is not None:
+            result = _get_local(node, cache)
+        else:
+            result = cache.storage.get_sync(node, None)
+        if result is not sentinel:
+            metrics._hit_count += 1
+            layer._hit_count += 1
+            return result
+        layer._miss_count += 1
+    metrics._miss_count += 1
+    return default
+
+
+def get_all_nowait(nodes: Sequence[Node[R]], default: Any = sentinel) -> List[Any]:
+    """
+    Get data from multiple nodes local caches synchronously, without loading or touching event loop.
+
+    :param nodes: sequence of nodes, must be same type.
+    :param default: used for nodes not found in any local cache, default is sentinel.
+    """
+    if len(nodes) == 0:
+        return []
+    node_cls = nodes[0].__class__
+    results: Dict[str, Any] = {}
+    pending: Sequence[Node] = nodes
+    for node in nodes:
+        if node.__class__ != node_cls:
+            raise Exception(
+                f"node class mismatch: expect [{node_cls}], get [{node.__class__}]"
+            )
+    if sampler._sampler is not None:
+        for node in nodes:
+            sampler._sampler.record_get(node_cls, node.full_key())
+    plan = get_plan(node_cls.Meta)
+    metrics = node_cls.Meta.metrics.shard()
+    for cache, layer in zip(plan.local, metrics.local_layers(plan)):
+        result = cache.storage.get_all_sync(pending, None)
+        layer._hit_count += len(result)
+        for k, v in result:
+            results[k.full_key()] = v
+        pending = [node for node in pending if node.full_key() not in results]
+        if len(pending) == 0:
+            break
+    metrics._hit_count += len(results)
+    return [results.get(node.full_key(), default) for node in nodes]
+
+
+def _get_negative(key: str) -> Optional[BaseException]:
+    item = _negatives.get(key, None)
+    if item is None:
+        return None
+    if item[0] <= time_ns():
+        _negatives.pop(key, None)
+        return None
+    return item[1]
+
+
+# raise a copy of cached failure, so tracebacks of callers don't pile up on one instance
+def _raise_negative(error: BaseException) -> NoReturn:
+    try:
+        fresh = copy(error)
+    except Exception:
+        raise error.with_traceback(None)
+    raise fresh from error
+
+
+def _set_negative(key: str, e: BaseException, ttl: timedelta):
+    now = time_ns()
+    if len(_negatives) >= _negatives_max_size:
+        for k in [k for k, v in _negatives.items() if v[0] <= now]:
+            _negatives.pop(k, None)
+        if len(_negatives) >= _negatives_max_size:
+            _negatives.clear()
+    _negatives[key] = (now + int(ttl.total_seconds() * 1e9), e)
+
+
+def _get_local(node: Node, cache: Cache, load_fn=None) -> Any:
+    if not cache.revalidate:
+        return cache.storage.get_sync(node, None)
+    return _get_or_revalidate(
+        node, cache, cache.storage.get_entry_sync(node, None), load_fn
+    )
+
+
+async def _get_remote(node: Node, cache: Cache, load_fn=None) -> Any:
+    serializer = node.get_seriaizer()
+    if not cache.revalidate:
+        return await cache.storage.get(node, serializer)
+    return _get_or_revalidate(
+        node, cache, await cache.storage.get_entry(node, serializer), load_fn
+    )
+
+
+async def _load(node: Node, load_fn=None) -> Any:
+    return await node.load() if load_fn is None else await load_fn(node)
+
+
 # try load data from remote storages, load from source if not found
 async def _load_from_caches(
-    node: Node, caches: List[Cache], miss: List[Cache], load_fn=None
+    node: Node,
+    plan: Plan,
+    miss: List[Cache],
+    load_fn=None,
+    tracer: Optional[Tracer] = None,
 ):
-    serializer = node.get_seriaizer()
+    metrics = node.Meta.metrics.shard()
     result = sentinel
-    for cache in caches:
-        result = await cache.storage.get(node, serializer)
+    for cache in plan.remote:
+        layer = metrics.layer(cache._storage_name)
+        now = time_ns()
+        if tracer is None:
+            result = await _get_remote(node, cache, load_fn)
+        else:
+            result = await tracing.trace(
+                tracer,
+                tracing.REMOTE,
+                node.__class__,
+                node.full_key(),
+                cache._storage_name,
+                _get_remote(node, cache, load_fn),
+            )
+        elapsed = time_ns() - now
+        layer._get_latency.record(elapsed)
+        metrics._lookup_latency.record(elapsed)
         if result is not sentinel:
+            layer._hit_count += 1
             break
+        layer._miss_count += 1
         miss.append(cache)
     # load from source
     if result is sentinel:
-        result = await node.load() if load_fn is None else await load_fn(node)
+        if plan.lease is None:
+            load = _load(node, load_fn)
+        else:
+            load = _load_with_lease(node, plan.lease, miss, load_fn)
+        if tracer is not None:
+            load = tracing.trace(
+                tracer, tracing.LOAD, node.__class__, node.full_key(), None, load
+            )
+        result = await load
+
+    return result
+
 
+def _lock_key(node: Node) -> str:
+    return f"{node.full_key()}:lock"
+
+
+# distributed singleflight: only lease holder loads from source and fill the cache,
+# others poll the cache until data filled, or lock released/expired
+async def _load_with_lease(node: Node, cache: Cache, miss: List[Cache], load_fn=None):
+    storage = cache.storage
+    serializer = node.get_seriaizer()
+    lease = cast(timedelta, cache.lease)
+    lock_key = _lock_key(node)
+    token = uuid4().hex
+    interval = 0.005
+    polled = False
+    while not await storage.acquire_lock(lock_key, token, lease):
+        polled = True
+        await sleep(interval)
+        interval = min(interval * 2, 0.1)
+        result = await storage.get(node, serializer)
+        if result is not sentinel:
+            miss.remove(cache)
+            return result
+    try:
+        # previous holder may fill data and release lock right after last poll
+        result = await storage.get(node, serializer) if polled else sentinel
+        if result is sentinel:
+            result = await node.load() if load_fn is None else await load_fn(node)
+            # fill before release, waiters are polling this cache
+            await storage.set(node, result, cache.ttl, serializer)
+    finally:
+        await storage.release_lock(lock_key, token)
+    miss.remove(cache)
     return result
 
 
-async def get_all(nodes: Sequence[Node[R]]) -> List[R]:
+# return data of cached entry, schedule a background reload if entry is stale
+def _get_or_revalidate(node: Node, cache: Cache, entry: Any, load_fn=None) -> Any:
+    if entry is sentinel:
+        return sentinel
+    entry = cast(CachedData, entry)
+    if entry.expire is not None and _should_refresh(node, cache, entry.expire):
+        key = node.full_key()
+        # reuse singleflight map, so only one reload is scheduled for each key
+        if key not in _awaits:
+            future = _awaits.start(key)
+            # map is full, serve stale data without refresh to avoid stampede
+            if _awaits.get(key) is not future:
+                return entry.data
+            task = ensure_future(_revalidate(node, future, entry.data, load_fn))
+            _tasks.add(task)
+            task.add_done_callback(_tasks.discard)
+    return entry.data
+
+
+def _should_refresh(node: Node, cache: Cache, expire: datetime) -> bool:
+    now = datetime.now(timezone.utc)
+    if cache.stale is not None and expire - cache.stale <= now:
+        return True
+    if cache.beta is not None:
+        # XFetch: refresh early with probability growing as expire approaches,
+        # scaled by how long a load takes, so usually only one caller refreshes.
+        # Load time is estimated from current thread shard, not aggregated on each read
+        shard = node.Meta.metrics.shard()
+        load_count = shard._load_success_count + shard._load_failure_count
+        if load_count == 0:
+            return False
+        delta = shard._total_load_time / load_count / 1e9
+        gap = -delta * cache.beta * log(1.0 - random())
+        return (expire - now).total_seconds() <= gap
+    return False
+
+
+async def _revalidate(node: Node, future: Future, stale: Any, load_fn=None):
+    metrics = node.Meta.metrics.shard()
+    lease_cache = get_plan(node.Meta).lease
+    token = uuid4().hex
+    now = time_ns()
+    try:
+        # lease hold by other process, which is refreshing same data
+        if lease_cache is not None and not await lease_cache.storage.acquire_lock(
+            _lock_key(node), token, cast(timedelta, lease_cache.lease)
+        ):
+            _awaits.set_result(future, stale)
+            return
+        try:
+            load = _load(node, load_fn)
+            tracer = tracing._tracer
+            if tracer is not None:
+                load = tracing.trace(
+                    tracer, tracing.LOAD, node.__class__, node.full_key(), None, load
+                )
+            result = await load
+            for cache in node.Meta.caches:
+                await cache.storage.set(node, result, cache.ttl, node.Meta.serializer)
+        finally:
+            if lease_cache is not None:
+                await lease_cache.storage.release_lock(_lock_key(node), token)
+    except Exception as e:
+        metrics._load_failure_count += 1
+        _record_load(metrics, time_ns() - now)
+        # background reload failure is not fatal, only waiters will get the exception
+        _awaits.set_exception(future, e)
+        return
+    finally:
+        _awaits.remove(node.full_key(), future)
+    metrics._load_success_count += 1
+    _record_load(metrics, time_ns() - now)
+    _awaits.set_result(future, result)
+
+
+async def get_all(
+    nodes: Sequence[Node[R]],
+    load_fn: Optional[
+        Callable[[Sequence[Node]], Awaitable[Sequence[Tuple[Node, Any]]]]
+    ] = None,
+    _traced: bool = False,
+) -> List[R]:
     """
     Get data from multiple nodes. Will call load function if cahce miss.
 
-    :param nodes: sequence of nodes, must be same type.
+    :param nodes: sequence of nodes, can be different types. Keys in same remote storage
+        are fetched with one multi get, and misses of each type are loaded concurrently.
+    :param load_fn: override load_all function, which will be called with missing nodes instead of node load_all if set.
     """
     if len(nodes) == 0:
         return []
-    node_cls = nodes[0].__class__
-    metrics = nodes[0].get_metrics()
-    pending: Dict[str, Node] = {}
-    missing: Dict[Cache, Iterable[Node]] = {}
-    caches = nodes[0].get_caches()
-    results: OrderedDict[str, Any] = OrderedDict()
-    # initialize reuslts dict and pending list
-    for node in nodes:
-        if node.__class__ != node_cls:
-            raise Exception(
-                f"node class mismatch: expect [{node_cls}], get [{node.__class__}]"
-            )
-        pending[node.full_key()] = node
-        results[node.full_key()] = sentinel
-
-    # split local/remote cache
-    local_caches: List[Cache] = []
-    remote_caches: List[Cache] = []
-    for cache in caches:
-        if cache.is_local:
-            local_caches.append(cache)
-        else:
-            remote_caches.append(cache)
+    tracer = tracing._tracer
+    if tracer is not None and not _traced:
+        return await tracing.trace(
+            tracer,
+            tracing.GET,
+            tracing.node_type(nodes),
+            None,
+            None,
+            get_all(nodes, load_fn, True),
+        )
+    keys = [node.full_key() for node in nodes]
+    values: List[Any] = [sentinel] * len(nodes)
+    if sampler._sampler is not None:
+        for node, key in zip(nodes, keys):
+            sampler._sampler.record_get(node.__class__, key)
+    # result slot of each key, duplicate nodes share the first slot
+    slots: Dict[str, int] = {}
+    # group unique nodes by type, each type has its own caches and metrics
+    groups: Dict[Type[Node], List[Node]] = {}
+    duplicates: Dict[Type[Node], int] = {}
+    for i, node in enumerate(nodes):
+        node_cls = node.__class__
+        if keys[i] in slots:
+            duplicates[node_cls] = duplicates.get(node_cls, 0) + 1
+            continue
+        slots[keys[i]] = i
+        group = groups.get(node_cls, None)
+        if group is None:
+            group = groups[node_cls] = []
+        group.append(node)
 
     # load from local caches first
-    for cache in local_caches:
-        result = cache.storage.get_all_sync(tuple(pending.values()), None)
-        for k, v in result:
-            pending.pop(k.full_key(), None)
-            results[k.full_key()] = v
-        missing[cache] = tuple(pending.values())
+    missing: Dict[Type[Node], Dict[Cache, Iterable[Node]]] = {}
+    counts = {node_cls: len(group) for node_cls, group in groups.items()}
+    for node_cls, pending in groups.items():
+        missing_cls: Dict[Cache, Iterable[Node]] = {}
+        plan = get_plan(node_cls.Meta)
+        shard = node_cls.Meta.metrics.shard()
+        for cache, layer in zip(plan.local, shard.local_layers(plan)):
+            if tracer is None:
+                result = cache.storage.get_all_sync(pending, None)
+            else:
+                result = tracing.trace_sync(
+                    tracer,
+                    tracing.LOCAL,
+                    node_cls,
+                    None,
+                    cache._storage_name,
+                    cache.storage.get_all_sync,
+                    pending,
+                    None,
+                )
+            layer._hit_count += len(result)
+            layer._miss_count += len(pending) - len(result)
+            if len(result) > 0:
+                for k, v in result:
+                    values[slots[k.full_key()]] = v
+                if len(result) == len(pending):
+                    pending = []
+                else:
+                    pending = [
+                        node
+                        for node in pending
+                        if values[slots[node.full_key()]] is sentinel
+                    ]
+            missing_cls[cache] = pending
+        missing[node_cls] = missing_cls
+        groups[node_cls] = pending
 
     # load from remote cache
-    fetch: Dict[str, Node] = {}  # missing nodes, need to load from source
-    if len(pending) > 0:
-        wait: List[
-            Tuple[str, Future]
-        ] = []  # nodes already loading by others, only need to wait here
-        for node in pending.values():
-            future = _awaits.get(node.full_key(), None)
+    fetch: Dict[Type[Node], Dict[str, Node]] = {}  # missing nodes, need to load
+    wait: List[Tuple[str, Future]] = []  # nodes already loading by others
+    aws: List[Tuple[str, Future]] = []
+    for node_cls, pending in groups.items():
+        if len(pending) == 0:
+            continue
+        negative_ttl = node_cls.Meta.negative_ttl
+        fetch_cls: Dict[str, Node] = {}
+        for node in pending:
+            key = node.full_key()
+            if negative_ttl is not None:
+                error = _get_negative(key)
+                if error is not None:
+                    _raise_negative(error)
+            future = _awaits.get(key)
             if future is None:
-                fetch[node.full_key()] = node
+                fetch_cls[key] = node
             else:
-                wait.append((node.full_key(), future))
-
+                wait.append((key, future))
         # update metrics
-        metrics._miss_count += len(fetch)
-        metrics._hit_count += len(nodes) - len(fetch)
-
-        if len(fetch) > 0:
-            fetcher = Fetcher()
-            aws: List[Tuple[str, Future]] = []
-            for key, node in fetch.items():
-                future = Future()
-                _awaits[key] = future
-                aws.append((key, future))
-            fetcher.data = await _get_multi(
-                nodes[0], remote_caches, fetch, missing, metrics
+        metrics = node_cls.Meta.metrics.shard()
+        metrics._miss_count += len(fetch_cls)
+        metrics._hit_count += (
+            counts[node_cls] + duplicates.get(node_cls, 0) - len(fetch_cls)
+        )
+        if len(fetch_cls) > 0:
+            fetch[node_cls] = fetch_cls
+
+    if len(fetch) > 0:
+        for fetch_cls in fetch.values():
+            for key in fetch_cls:
+                aws.append((key, _awaits.start(key)))
+        futures = dict(aws)
+        try:
+            loaded = await _get_multi(
+                {node_cls: dict(fetch_cls) for node_cls, fetch_cls in fetch.items()},
+                missing,
+                lambda key, value: _awaits.set_result(futures[key], value),
+                load_fn,
             )
-            # load done, set all events and results
-            for aw in aws:
-                aw[1].set_result(fetcher.data[aw[0]])
-            for ks, vs in fetcher.data.items():
-                results[ks] = vs
-        for w in wait:
-            results[w[0]] = await w[1]
-
-    # fill missing caches
-    for cache, missing_nodes in missing.items():
-        data = [(node, results[node.full_key()]) for node in missing_nodes]
-        if len(data) > 0:
-            await cache.storage.set_all(data, cache.ttl, node_cls.Meta.serializer)
-
-    # remove tmp_cache
-    for key in fetch:
-        _awaits.pop(key)
+        except Exception as e:
+            for node_cls, fetch_cls in fetch.items():
+                negative_ttl = node_cls.Meta.negative_ttl
+                if negative_ttl is not None:
+                    for key in fetch_cls:
+                        _set_negative(key, e, negative_ttl)
+            for key, future in aws:
+                _awaits.remove(key, future)
+                _awaits.set_exception(future, e)
+            raise e
+        # load done, set all events and results
+        for key, future in aws:
+            _awaits.set_result(future, loaded[key])
+        for key, value in loaded.items():
+            values[slots[key]] = value
+    try:
+        for key, future in wait:
+            values[slots[key]] = await future
+
+        # fill missing caches
+        for node_cls, missing_cls in missing.items():
+            await _fill_all(node_cls, missing_cls, lambda key: values[slots[key]])
+    finally:
+        # remove tmp_cache, also on failure, resolved futures must not be reused
+        for key, future in aws:
+            _awaits.remove(key, future)
 
     # finally
-    return list(results.values())
+    if len(duplicates) > 0:
+        for i, key in enumerate(keys):
+            values[i] = values[slots[key]]
+    return values
+
+
+async def iter_all(
+    nodes: Union[Iterable[Node[R]], AsyncIterable[Node[R]]], window: int = 1000
+) -> AsyncIterator[Tuple[Node[R], R]]:
+    """
+    Get data from large amount of nodes, yield (node, data) window by window.
+    Only one window of nodes and data is kept in memory.
+
+    :param nodes: iterable or async iterable of nodes, can be different types.
+    :param window: nodes count of each get_all call.
+    """
+    chunk: List[Node[R]] = []
+    if isinstance(nodes, AsyncIterable):
+        async for node in nodes:
+            chunk.append(node)
+            if len(chunk) >= window:
+                for item in zip(chunk, await get_all(chunk)):
+                    yield item
+                chunk = []
+    else:
+        for node in nodes:
+            chunk.append(node)
+            if len(chunk) >= window:
+                for item in zip(chunk, await get_all(chunk)):
+                    yield item
+                chunk = []
+    if len(chunk) > 0:
+        for item in zip(chunk, await get_all(chunk)):
+            yield item
+
+
+async def _fill_all(
+    node_cls: Type[Node],
+    missing: Dict[Cache, Iterable[Node]],
+    value_of: Callable[[str], Any],
+):
+    for cache, missing_nodes in missing.items():
+        data = [(node, value_of(node.full_key())) for node in missing_nodes]
+        if cache.write_behind:
+            data = [
+                (node, value)
+                for node, value in data
+                if not cache.storage.set_later(
+                    node, value, cache.ttl, node_cls.Meta.serializer
+                )
+            ]
+        if len(data) == 0:
+            continue
+        fill = cache.storage.set_all(data, cache.ttl, node_cls.Meta.serializer)
+        tracer = tracing._tracer
+        if tracer is not None:
+            fill = tracing.trace(
+                tracer, tracing.FILL, node_cls, None, cache._storage_name, fill
+            )
+        if cache.is_local:
+            await fill
+            continue
+        now = time_ns()
+        await fill
+        node_cls.Meta.metrics.shard().layer(cache._storage_name)._set_latency.record(
+            time_ns() - now
+        )
+
+
+def _add_to_batch(node: Node, key: str, future: Future, window: timedelta):
+    batches = _batches.setdefault(get_running_loop(), {})
+    batch = batches.get(node.__class__, None)
+    if batch is None:
+        batch = {}
+        batches[node.__class__] = batch
+        task = ensure_future(_load_batch(batches, node.__class__, batch, window))
+        _tasks.add(task)
+        task.add_done_callback(_tasks.discard)
+        task.add_done_callback(partial(_end_batch, batches, node.__class__, batch))
+    batch[key] = (node, future)
+
+
+# DataLoader style batching: load all gets collected in window with one multi get
+async def _load_batch(
+    batches: Dict[Type[Node], Dict[str, Tuple[Node, Future]]],
+    node_cls: Type[Node],
+    batch: Dict[str, Tuple[Node, Future]],
+    window: timedelta,
+):
+    await sleep(window.total_seconds())
+    batches.pop(node_cls)
+    plan = get_plan(node_cls.Meta)
+    fetch = {key: node for key, (node, _) in batch.items()}
+    # gets reach remote caches only if all local caches missed
+    missing: Dict[Cache, Iterable[Node]] = {
+        cache: tuple(fetch.values()) for cache in plan.local
+    }
+    try:
+        results = await _get_multi(
+            {node_cls: dict(fetch)},
+            {node_cls: missing},
+            lambda key, value: _awaits.set_result(batch[key][1], value),
+        )
+    except Exception as e:
+        negative_ttl = node_cls.Meta.negative_ttl
+        for key, (_, future) in batch.items():
+            _awaits.remove(key, future)
+            if negative_ttl is not None:
+                _set_negative(key, e, negative_ttl)
+            _awaits.set_exception(future, e)
+        return
+    for key, (_, future) in batch.items():
+        _awaits.set_result(future, results[key])
+    try:
+        await _fill_all(node_cls, missing, results.__getitem__)
+    except Exception:
+        # results already delivered, cache fill is best effort
+        pass
+
+
+# remove batch futures after load task done, cancel unresolved ones if task is
+# cancelled, also before it starts, so waiters never hang
+def _end_batch(
+    batches: Dict[Type[Node], Dict[str, Tuple[Node, Future]]],
+    node_cls: Type[Node],
+    batch: Dict[str, Tuple[Node, Future]],
+    task: Task,
+):
+    if batches.get(node_cls, None) is batch:
+        batches.pop(node_cls)
+    for key, (_, future) in batch.items():
+        _awaits.remove(key, future)
+        if not future.done():
+            future.cancel()
 
 
 async def _get_multi(
-    node: Node,
-    caches: List[Cache],
-    nodes: Dict[str, Node],
-    missing: Dict[Cache, Iterable],
-    metrics: Metrics,
+    fetch: Dict[Type[Node], Dict[str, Node]],
+    missing: Dict[Type[Node], Dict[Cache, Iterable[Node]]],
+    on_load: Optional[Callable[[str, Any], None]] = None,
+    load_fn=None,
 ) -> Dict[str, Any]:
-    serializer = node.get_seriaizer()
     results: Dict[str, Any] = {}
-    for cache in caches:
-        cached = await cache.storage.get_all(list(nodes.values()), serializer)
-        for k, v in cached:
-            nodes.pop(k.full_key(), None)
-            results[k.full_key()] = v
-        missing[cache] = tuple(nodes.values())
+    layer = 0
+    while True:
+        # n-th remote cache of each node type, grouped by storage
+        groups: Dict[Storage, List[Tuple[Type[Node], Cache]]] = {}
+        for node_cls, nodes in fetch.items():
+            remote = get_plan(node_cls.Meta).remote
+            if layer < len(remote) and len(nodes) > 0:
+                groups.setdefault(remote[layer].storage, []).append(
+                    (node_cls, remote[layer])
+                )
+        if len(groups) == 0:
+            break
+        # one multi get for each storage
+        responses = await gather(
+            *[
+                _timed_get_all(
+                    storage,
+                    [
+                        node
+                        for node_cls, _ in group
+                        for node in fetch[node_cls].values()
+                    ],
+                    group[0],
+                )
+                for storage, group in groups.items()
+            ]
+        )
+        for group, (cached, elapsed) in zip(groups.values(), responses):
+            sizes = [len(fetch[node_cls]) for node_cls, _ in group]
+            for k, v in cached:
+                fetch[k.__class__].pop(k.full_key(), None)
+                results[k.full_key()] = v
+            for (node_cls, cache), size in zip(group, sizes):
+                metrics = node_cls.Meta.metrics.shard()
+                layer_metrics = metrics.layer(cache._storage_name)
+                layer_metrics._get_latency.record(elapsed)
+                metrics._lookup_latency.record(elapsed)
+                layer_metrics._hit_count += size - len(fetch[node_cls])
+                layer_metrics._miss_count += len(fetch[node_cls])
+                missing[node_cls][cache] = tuple(fetch[node_cls].values())
+        layer += 1
+
+    # load from source, each node type concurrently
+    loads = [(node_cls, nodes) for node_cls, nodes in fetch.items() if len(nodes) > 0]
+    loaded = await gather(
+        *[
+            _load_all(node_cls, tuple(nodes.values()), on_load, load_fn)
+            for node_cls, nodes in loads
+        ]
+    )
+    for (node_cls, nodes), data in zip(loads, loaded):
+        results.update(data)
+        if len(data) == len(nodes):
+            continue
+        # nodes not returned by load_all are None and not cached
+        for key in nodes:
+            if key not in data:
+                results[key] = None
+        for cache, pending in missing[node_cls].items():
+            missing[node_cls][cache] = tuple(
+                node for node in pending if node.full_key() in data
+            )
+    return results
 
-    # load from source
-    if len(nodes) > 0:
-        now = time_ns()
-        try:
-            loaded = await node.load_all(tuple(nodes.values()))
+
+async def _timed_get_all(
+    storage: Storage, nodes: Sequence[Node], first: Tuple[Type[Node], Cache]
+) -> Tuple[Sequence[Tuple[Node, Any]], int]:
+    now = time_ns()
+    get = storage.get_all_mixed(nodes)
+    tracer = tracing._tracer
+    if tracer is not None:
+        # nodes of different types in same storage share one span
+        get = tracing.trace(
+            tracer, tracing.REMOTE, first[0], None, first[1]._storage_name, get
+        )
+    result = await get
+    return result, time_ns() - now
+
+
+def _record_load(metrics: MetricsShard, elapsed: int):
+    metrics._total_load_time += elapsed
+    metrics._load_latency.record(elapsed)
+
+
+async def _load_all(
+    node_cls: Type[Node],
+    nodes: Sequence[Node],
+    on_load: Optional[Callable[[str, Any], None]] = None,
+    load_fn=None,
+) -> Dict[str, Any]:
+    metrics = node_cls.Meta.metrics.shard()
+    results: Dict[str, Any] = {}
+    tracer = tracing._tracer
+    if tracer is not None:
+        span = tracer.start(tracing.LOAD, node_cls, None, None)
+    now = time_ns()
+    try:
+        if load_fn is not None:
+            for k, v in await load_fn(nodes):
+                results[k.full_key()] = v
+        elif node_cls.Meta.stream_load:
+            # partial results, waiters of fast keys don't wait slow ones
+            stream = node_cls.load_stream(nodes)
+            try:
+                async for k, v in stream:
+                    results[k.full_key()] = v
+                    if on_load is not None:
+                        on_load(k.full_key(), v)
+            finally:
+                # stop pending loads of generator now, instead of on garbage collection
+                aclose = getattr(stream, "aclose", None)
+                if aclose is not None:
+                    await aclose()
+        else:
+            loaded = await node_cls.load_all(nodes)
             for k, v in loaded:
                 results[k.full_key()] = v
-        except Exception as e:
-            metrics._load_failure_count += len(nodes)
-            metrics._total_load_time += time_ns() - now
-            raise (e)
-        metrics._load_success_count += len(nodes)
-        metrics._total_load_time += time_ns() - now
+    except Exception as e:
+        metrics._load_failure_count += len(nodes)
+        _record_load(metrics, time_ns() - now)
+        if tracer is not None:
+            tracer.end(span, tracing.ERROR, e)
+        raise (e)
+    metrics._load_success_count += len(nodes)
+    _record_load(metrics, time_ns() - now)
+    if tracer is not None:
+        tracer.end(span, tracing.OK)
     return results
 
 
@@ -274,39 +985,157 @@ class Cached(Protocol[P, R]):
 
 
 def Wrapper(
-    fn: Callable[P, R],
+    fn: Callable[P, R], node_cache_size: int = 0, in_executor: bool = False
 ) -> Cached[P, R]:
-    _func = fn
+    _func = to_async(fn, in_executor)
     _node_func = None
+    # args -> node, avoid building node and full key again for same args
+    _node_cache: Dict[Any, Node] = {}
+    _node_cache_prefix = models._prefix
 
     def to_node(fn: Callable[P, Node]):
         nonlocal _node_func
         _node_func = fn
 
-    async def fetch(*args: P.args, **kwargs: P.kwargs) -> R:
-        node = _node_func(*args, **kwargs)  # type: ignore
-        node = cast(Node, node)
-
-        # inline load function
-        async def load() -> Any:
-            return await _func(*args, **kwargs)  # type: ignore
+    def node_of(args: Any, kwargs: Any) -> Node:
+        nonlocal _node_cache_prefix
+        if node_cache_size == 0:
+            return _node_func(*args, **kwargs)  # type: ignore
+        # cached full keys are invalid after prefix changed
+        if _node_cache_prefix != models._prefix:
+            _node_cache.clear()
+            _node_cache_prefix = models._prefix
+        key = (args, tuple(kwargs.items())) if kwargs else args
+        try:
+            node = _node_cache.get(key, None)
+        except TypeError:
+            # unhashable args
+            return _node_func(*args, **kwargs)  # type: ignore
+        if node is None:
+            node = _node_func(*args, **kwargs)  # type: ignore
+            if len(_node_cache) >= node_cache_size:
+                _node_cache.clear()
+            _node_cache[key] = node
+        return cast(Node, node)
 
-        node.load = load  # type: ignore
-        return await get(node)
+    async def fetch(*args: P.args, **kwargs: P.kwargs) -> R:
+        node = node_of(args, kwargs)
+        # fast path: hit on first local cache, no load function needed
+        plan = get_plan(node.Meta)
+        if len(plan.local) > 0 and not plan.local[0].revalidate:
+            result = plan.local[0].storage.get_sync(node, None)
+            if result is not sentinel:
+                if sampler._sampler is not None:
+                    sampler._sampler.record_get(node.__class__, node.full_key())
+                metrics = node.Meta.metrics.shard()
+                metrics._hit_count += 1
+                metrics.local_layers(plan)[0]._hit_count += 1
+                return cast(R, result)
+        return await get(node, lambda _: _func(*args, **kwargs))  # type: ignore
 
     fetch.to_node = to_node  # type: ignore
     return fetch  # type: ignore
 
 
 class Memoize:
-    def __init__(self, node: Type[Node]):
+    """
+    Memoize function with node.
+
+    :param node: node class used to cache function result.
+    :param node_cache_size: cache nodes built by to_node function, keyed by function args.
+        Only hashable args are cached, default 0(disabled).
+    """
+
+    def __init__(self, node: Type[Node], node_cache_size: int = 0):
         self.node = node
+        self.node_cache_size = node_cache_size
+
+    @overload
+    def __call__(self, fn: Callable[P, Awaitable[R]]) -> Cached[P, Awaitable[R]]:
+        ...
 
-    def __call__(self, fn: Callable[P, R]) -> Cached[P, R]:
-        wrapper = Wrapper(fn)
+    # sync function, run in executor if Meta.run_in_executor is set, else in event loop
+    @overload
+    def __call__(self, fn: Callable[P, R]) -> Cached[P, Awaitable[R]]:
+        ...
+
+    def __call__(self, fn):
+        wrapper = Wrapper(fn, self.node_cache_size, self.node.Meta.run_in_executor)
         return update_wrapper(wrapper, fn)
 
 
+class CachedAll(Protocol[P, R]):
+    def to_node(self, fn: Callable[..., Node]):
+        ...
+
+    def __call__(self, *args, **kwargs) -> R:
+        ...
+
+
+class MemoizeAll:
+    """
+    Memoize bulk function, which takes a list of ids as first argument and returns a mapping of id to data.
+    Cached ids are served with get_all, function is called with missing ids only.
+
+    :param node: node class used to cache data of each id.
+    """
+
+    def __init__(self, node: Type[Node]):
+        self.node = node
+
+    @overload
+    def __call__(
+        self, fn: Callable[Concatenate[Sequence[K], P], Awaitable[Mapping[K, V]]]
+    ) -> CachedAll[Concatenate[Sequence[K], P], Awaitable[Dict[K, V]]]:
+        ...
+
+    # sync function, run in executor if Meta.run_in_executor is set, else in event loop
+    @overload
+    def __call__(
+        self, fn: Callable[Concatenate[Sequence[K], P], Mapping[K, V]]
+    ) -> CachedAll[Concatenate[Sequence[K], P], Awaitable[Dict[K, V]]]:
+        ...
+
+    def __call__(self, fn):
+        _func = to_async(fn, self.node.Meta.run_in_executor)
+        _node_func: Optional[Callable[..., Node]] = None
+
+        def to_node(fn: Callable[..., Node]):
+            nonlocal _node_func
+            _node_func = fn
+
+        async def fetch(ids: Sequence[K], *args: P.args, **kwargs: P.kwargs):
+            ids = list(ids)
+            node_func = cast(Callable[..., Node], _node_func)
+            nodes = [node_func(i, *args, **kwargs) for i in ids]
+            # load_all receives same node objects
+            id_of = {id(node): i for node, i in zip(nodes, ids)}
+
+            async def load_all(missing: Sequence[Node]):
+                missing_ids = [id_of[id(node)] for node in missing]
+                data = await _func(missing_ids, *args, **kwargs)
+                # ids not returned by function are None and not cached
+                return [
+                    (node, data[i])
+                    for node, i in zip(missing, missing_ids)
+                    if i in data
+                ]
+
+            values = await get_all(nodes, load_all)
+            return dict(zip(ids, values))
+
+        fetch.to_node = to_node  # type: ignore
+        return update_wrapper(fetch, fn)  # type: ignore
+
+
+async def drain():
+    """
+    Write all pending write-behind cache fills, call this before shutdown.
+    """
+    for storage in list_storages().values():
+        await storage.drain()
+
+
 def nodes() -> List[Type[Node]]:
     return get_nodes()
 
@@ -316,6 +1145,7 @@ def stats(node: Type[Node]) -> Metrics:
 
 
 async def invalidate(node: Node):
+    _negatives.pop(node.full_key(), None)
     caches = node.get_caches()
     for cache in caches:
         await cache.storage.remove(node)
@@ -343,7 +1173,7 @@ def build_node(
     new.Meta.caches = caches
     new.Meta.serializer = serializer
     new.Meta.doorkeeper = doorkeeper
-    new.Meta.metrics = Metrics()
+    new.Meta.metrics = new_metrics(new)
     _dynamic_nodes[name] = new
     _add_node(new)
     return new
@@ -3,10 +3,14 @@ from typing import Dict
 from cacheme.interfaces import Storage
 
 _storages: Dict[str, Storage] = {}
+# increased on each register, cache plans built with old version are rebuilt
+_version: int = 0
 
 
 async def register_storage(name: str, storage: Storage):
+    global _version
     _storages[name] = storage
+    _version += 1
     await storage.connect()
 
 
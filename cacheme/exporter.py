@@ -0,0 +1,329 @@
+import re
+import socket
+from asyncio import CancelledError, Task, ensure_future, sleep
+from datetime import timedelta
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+from cacheme.core import _awaits_len, nodes
+from cacheme.data import list_storages
+from cacheme.interfaces import Histogram
+
+QUANTILES = (0.5, 0.9, 0.99)
+
+
+class Sample(NamedTuple):
+    # metric family name, OpenMetrics suffix such as _total is not included
+    name: str
+    # counter, gauge or summary
+    kind: str
+    help: str
+    labels: Tuple[Tuple[str, str], ...]
+    # counter/gauge: value, summary: quantiles, count and sum
+    value: float
+    quantiles: Tuple[Tuple[float, float], ...] = ()
+    sample_count: int = 0
+
+
+def _ns(value: int) -> float:
+    return value / 1e9
+
+
+def _summary(
+    name: str, help: str, labels: Tuple[Tuple[str, str], ...], hist: Histogram
+) -> Sample:
+    quantiles = tuple((q, _ns(hist.percentile(q * 100))) for q in QUANTILES)
+    return Sample(
+        name, "summary", help, labels, _ns(hist.total()), quantiles, hist.count()
+    )
+
+
+def collect() -> List[Sample]:
+    """
+    Snapshot metrics of all registered nodes and storages.
+    Latency values are in seconds.
+    """
+    samples: List[Sample] = []
+    for node in nodes():
+        metrics = node.get_metrics()
+        # qualified name, node classes in different modules can have same name
+        name = f"{node.__module__}.{node.__qualname__}"
+        labels: Tuple[Tuple[str, str], ...] = (("node", name),)
+        samples += [
+            Sample(
+                "cacheme_hits", "counter", "Cache hits.", labels, metrics.hit_count()
+            ),
+            Sample(
+                "cacheme_misses",
+                "counter",
+                "Cache misses.",
+                labels,
+                metrics.miss_count(),
+            ),
+            Sample(
+                "cacheme_load_success",
+                "counter",
+                "Successful loads.",
+                labels,
+                metrics.load_success_count(),
+            ),
+            Sample(
+                "cacheme_load_failure",
+                "counter",
+                "Failed loads.",
+                labels,
+                metrics.load_failure_count(),
+            ),
+            _summary(
+                "cacheme_load_latency_seconds",
+                "Load latency.",
+                labels,
+                metrics.load_latency(),
+            ),
+            _summary(
+                "cacheme_lookup_latency_seconds",
+                "Remote cache lookup latency.",
+                labels,
+                metrics.lookup_latency(),
+            ),
+        ]
+        for layer_name, layer in metrics.layers().items():
+            layer_labels = labels + (("storage", layer_name),)
+            samples += [
+                Sample(
+                    "cacheme_layer_hits",
+                    "counter",
+                    "Cache hits of each cache layer.",
+                    layer_labels,
+                    layer.hit_count(),
+                ),
+                Sample(
+                    "cacheme_layer_misses",
+                    "counter",
+                    "Cache misses of each cache layer.",
+                    layer_labels,
+                    layer.miss_count(),
+                ),
+                _summary(
+                    "cacheme_layer_get_latency_seconds",
+                    "Remote cache layer get latency.",
+                    layer_labels,
+                    layer.get_latency(),
+                ),
+                _summary(
+                    "cacheme_layer_set_latency_seconds",
+                    "Remote cache layer set latency.",
+                    layer_labels,
+                    layer.set_latency(),
+                ),
+            ]
+    for name, storage in list_storages().items():
+        labels = (("storage", name),)
+        samples += [
+            Sample(
+                "cacheme_storage_write_queue",
+                "gauge",
+                "Sets waiting in write-behind queue.",
+                labels,
+                storage.write_queue_size(),
+            ),
+            Sample(
+                "cacheme_storage_write_failures",
+                "counter",
+                "Write-behind sets failed.",
+                labels,
+                storage.write_failure_count(),
+            ),
+        ]
+        weighted_size = storage.weighted_size()
+        if weighted_size is not None:
+            samples.append(
+                Sample(
+                    "cacheme_storage_weighted_size_bytes",
+                    "gauge",
+                    "Total weight of local storage values.",
+                    labels,
+                    weighted_size,
+                )
+            )
+    samples.append(
+        Sample(
+            "cacheme_inflight_loads",
+            "gauge",
+            "In-flight shared loads.",
+            (),
+            _awaits_len(),
+        )
+    )
+    return samples
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(labels: Sequence[Tuple[str, str]]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels) + "}"
+
+
+def openmetrics(samples: Optional[List[Sample]] = None) -> str:
+    """
+    Render metrics in OpenMetrics text format, serve it with content type
+    `application/openmetrics-text; version=1.0.0; charset=utf-8`.
+    """
+    if samples is None:
+        samples = collect()
+    families: Dict[str, List[Sample]] = {}
+    for sample in samples:
+        families.setdefault(sample.name, []).append(sample)
+    lines: List[str] = []
+    for name, family in families.items():
+        kind = family[0].kind
+        lines.append(f"# TYPE {name} {kind}")
+        lines.append(f"# HELP {name} {family[0].help}")
+        for sample in family:
+            if kind == "counter":
+                lines.append(f"{name}_total{_labels(sample.labels)} {sample.value}")
+            elif kind == "gauge":
+                lines.append(f"{name}{_labels(sample.labels)} {sample.value}")
+            else:
+                for q, value in sample.quantiles:
+                    labels = sample.labels + (("quantile", str(q)),)
+                    lines.append(f"{name}{_labels(labels)} {value}")
+                lines.append(
+                    f"{name}_count{_labels(sample.labels)} {sample.sample_count}"
+                )
+                lines.append(f"{name}_sum{_labels(sample.labels)} {sample.value}")
+    lines.append("# EOF")
+    return "\n".join(lines) + "\n"
+
+
+_invalid = re.compile(r"[^A-Za-z0-9_\-]")
+
+
+class StatsdExporter:
+    """
+    Push metrics to StatsD over UDP. Counters are sent as deltas since last push,
+    gauges and latency quantiles(in milliseconds) are sent as gauges:
+    `{prefix}.node.{node}.load_latency.p99`.
+    Labels become part of metric name: `{prefix}.node.{node}.hits`, characters
+    other than letters, digits, `_` and `-` in label values are replaced by `_`.
+
+    :param host: StatsD host.
+    :param port: StatsD port.
+    :param prefix: metric name prefix.
+    :param interval: push interval of `start`.
+    :param max_packet_size: max bytes of each UDP packet, lines are packed together.
+    """
+
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 8125,
+        prefix: str = "cacheme",
+        interval: timedelta = timedelta(seconds=10),
+        max_packet_size: int = 1432,
+    ):
+        self.address = (host, port)
+        self.prefix = prefix
+        self.interval = interval.total_seconds()
+        self.max_packet_size = max_packet_size
+        self._last: Dict[str, float] = {}
+        self._socket: Optional[socket.socket] = None
+        self._task: Optional[Task] = None
+
+    def _name(self, sample: Sample, *suffix: str) -> str:
+        parts = [self.prefix]
+        for k, v in sample.labels:
+            parts += [k, _invalid.sub("_", v)]
+        name = sample.name[len("cacheme_") :]
+        # cacheme_storage_write_queue -> cacheme.storage.{name}.write_queue
+        if sample.labels and name.startswith(f"{sample.labels[-1][0]}_"):
+            name = name[len(sample.labels[-1][0]) + 1 :]
+        # latency quantiles are sent in milliseconds
+        if name.endswith("_seconds"):
+            name = name[: -len("_seconds")]
+        parts.append(name)
+        return ".".join(parts + list(suffix))
+
+    def _delta(self, name: str, value: float) -> float:
+        delta = value - self._last.get(name, 0)
+        self._last[name] = value
+        return delta
+
+    def lines(self, samples: Optional[List[Sample]] = None) -> List[str]:
+        if samples is None:
+            samples = collect()
+        lines: List[str] = []
+        for sample in samples:
+            if sample.kind == "counter":
+                name = self._name(sample)
+                delta = self._delta(name, sample.value)
+                if delta != 0:
+                    lines.append(f"{name}:{delta:g}|c")
+            elif sample.kind == "gauge":
+                lines.append(f"{self._name(sample)}:{sample.value:g}|g")
+            else:
+                name = self._name(sample, "count")
+                delta = self._delta(name, sample.sample_count)
+                if delta == 0:
+                    continue
+                lines.append(f"{name}:{delta:g}|c")
+                for q, value in sample.quantiles:
+                    p = f"p{q * 100:g}".replace(".", "_")
+                    lines.append(f"{self._name(sample, p)}:{value * 1000:g}|g")
+        return lines
+
+    def push(self):
+        """
+        Send metrics once.
+        """
+        if self._socket is None:
+            self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self._socket.setblocking(False)
+        packet = b""
+        for line in self.lines():
+            data = line.encode()
+            if packet and len(packet) + len(data) + 1 > self.max_packet_size:
+                self._send(packet)
+                packet = b""
+            packet = packet + b"\n" + data if packet else data
+        if packet:
+            self._send(packet)
+
+    def _send(self, packet: bytes):
+        assert self._socket is not None
+        try:
+            self._socket.sendto(packet, self.address)
+        except OSError:
+            # metrics are best effort, dropped if StatsD is not reachable
+            pass
+
+    async def _run(self):
+        while True:
+            await sleep(self.interval)
+            self.push()
+
+    def start(self):
+        """
+        Push metrics on interval in background, must be called in running event loop.
+        """
+        if self._task is None:
+            self._task = ensure_future(self._run())
+
+    async def stop(self):
+        """
+        Stop background push, send last metrics and close socket.
+        """
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except CancelledError:
+                pass
+            self._task = None
+        self.push()
+        if self._socket is not None:
+            self._socket.close()
+            self._socket = None
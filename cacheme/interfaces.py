@@ -1,5 +1,18 @@
+import threading
 from datetime import datetime, timedelta
-from typing import TYPE_CHECKING, NamedTuple, Optional, Sequence, Tuple, TypeVar, List
+from typing import (
+    TYPE_CHECKING,
+    AsyncIterator,
+    Callable,
+    Dict,
+    List,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Tuple,
+    Type,
+    TypeVar,
+)
 
 from typing_extensions import Any, Protocol, ClassVar
 
@@ -8,6 +21,154 @@ if TYPE_CHECKING:
 
 R = TypeVar("R", covariant=True)
 
+
+class Histogram:
+    """
+    Fixed-bucket latency histogram in nanoseconds, HDR style: each power of 2 range
+    is split into 8 linear sub buckets, so relative error is at most 12.5%.
+    Values over 2^40ns(about 18 minutes) are counted in the last bucket.
+    """
+
+    SUB_BITS = 3
+    MAX_BITS = 40
+
+    __slots__ = ["_counts", "_count", "_total", "_max"]
+
+    def __init__(self):
+        self._counts = [0] * self._index((1 << self.MAX_BITS) - 1) + [0]
+        self._count = 0
+        self._total = 0
+        self._max = 0
+
+    @classmethod
+    def _index(cls, value: int) -> int:
+        shift = value.bit_length() - cls.SUB_BITS - 1
+        if shift <= 0:
+            return value
+        return (shift << cls.SUB_BITS) + (value >> shift)
+
+    @classmethod
+    def _bounds(cls, index: int) -> Tuple[int, int]:
+        if index < (2 << cls.SUB_BITS):
+            return index, index
+        shift = (index >> cls.SUB_BITS) - 1
+        low = ((index & ((1 << cls.SUB_BITS) - 1)) | (1 << cls.SUB_BITS)) << shift
+        return low, low + (1 << shift) - 1
+
+    def record(self, value: int):
+        index = self._index(value)
+        if index >= len(self._counts):
+            index = len(self._counts) - 1
+        self._counts[index] += 1
+        self._count += 1
+        self._total += value
+        if value > self._max:
+            self._max = value
+
+    def count(self) -> int:
+        return self._count
+
+    def total(self) -> int:
+        return self._total
+
+    def max(self) -> int:
+        return self._max
+
+    def mean(self) -> float:
+        return self._total / self._count if self._count else 0.0
+
+    def merge(self, other: "Histogram"):
+        for index, count in enumerate(other._counts):
+            if count:
+                self._counts[index] += count
+        self._count += other._count
+        self._total += other._total
+        if other._max > self._max:
+            self._max = other._max
+
+    def percentile(self, p: float) -> int:
+        """
+        Value at percentile p(0-100), upper bound of the bucket, 0 if empty.
+        """
+        if self._count == 0:
+            return 0
+        target = max(1, int(self._count * p / 100 + 0.5))
+        seen = 0
+        for index, count in enumerate(self._counts):
+            seen += count
+            if seen >= target:
+                return min(self._bounds(index)[1], self._max)
+        return self._max
+
+
+class LayerMetrics:
+    """
+    Metrics of one cache layer of a node.
+    """
+
+    def __init__(self):
+        self._hit_count = 0
+        self._miss_count = 0
+        self._get_latency = Histogram()
+        self._set_latency = Histogram()
+
+    def hit_count(self) -> int:
+        return self._hit_count
+
+    def miss_count(self) -> int:
+        return self._miss_count
+
+    def hit_rate(self) -> float:
+        total = self._hit_count + self._miss_count
+        return self._hit_count / total if total else 0.0
+
+    # remote storage only
+    def get_latency(self) -> Histogram:
+        return self._get_latency
+
+    # remote storage only
+    def set_latency(self) -> Histogram:
+        return self._set_latency
+
+    def merge(self, other: "LayerMetrics"):
+        self._hit_count += other._hit_count
+        self._miss_count += other._miss_count
+        self._get_latency.merge(other._get_latency)
+        self._set_latency.merge(other._set_latency)
+
+
+class MetricsShard:
+    """
+    Metrics updated by one thread, so counters can be increased without lock.
+    """
+
+    def __init__(self):
+        self._hit_count = 0
+        self._miss_count = 0
+        self._load_success_count = 0
+        self._load_failure_count = 0
+        self._total_load_time = 0
+        self._load_latency = Histogram()
+        self._lookup_latency = Histogram()
+        self._layers: Dict[str, LayerMetrics] = {}
+        self._plan: Any = None
+        self._local_layers: Tuple[LayerMetrics, ...] = ()
+
+    def layer(self, storage: str) -> LayerMetrics:
+        layer = self._layers.get(storage, None)
+        if layer is None:
+            layer = self._layers[storage] = LayerMetrics()
+        return layer
+
+    # layer metrics of plan local caches, resolved once for each plan,
+    # always same length as plan.local so they can be zipped
+    def local_layers(self, plan: Any) -> Tuple[LayerMetrics, ...]:
+        if plan is not self._plan or len(self._local_layers) != len(plan.local):
+            self._local_layers = tuple(self.layer(c._storage_name) for c in plan.local)
+            self._plan = plan
+        return self._local_layers
+
+
 # - When a cache lookup encounters an existing cache entry hit_count is incremented
 # - After successfully loading an entry miss_count and load_success_count are
 # incremented, and the total loading time, in nanoseconds, is added to total_load_time
@@ -15,44 +176,101 @@ R = TypeVar("R", covariant=True)
 # miss_count and load_failure_count are incremented, and the total loading
 # time, in nanoseconds, is added to total_load_time
 class Metrics:
-    _hit_count: int = 0
-    _miss_count: int = 0
-    _load_success_count: int = 0
-    _load_failure_count: int = 0
-    _total_load_time: int = 0
+    """
+    Metrics of a node. Each thread updates its own shard, shards are aggregated on read.
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+        self._shards: List[MetricsShard] = []
+        self._lock = threading.Lock()
+
+    def _new_shard(self) -> MetricsShard:
+        return MetricsShard()
+
+    # shard of current thread
+    def shard(self) -> MetricsShard:
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard = self._new_shard()
+            with self._lock:
+                self._shards = self._shards + [shard]
+            self._local.shard = shard
+            return shard
+
+    def _sum(self, name: str) -> int:
+        return sum(getattr(shard, name) for shard in self._shards)
+
+    def _merge(self, name: str) -> Histogram:
+        merged = Histogram()
+        for shard in self._shards:
+            merged.merge(getattr(shard, name))
+        return merged
 
     def request_count(self) -> int:
-        return self._hit_count + self._miss_count
+        return self.hit_count() + self.miss_count()
 
     def hit_count(self) -> int:
-        return self._hit_count
+        return self._sum("_hit_count")
 
     def hit_rate(self) -> float:
-        return self._hit_count / self.request_count()
+        count = self.request_count()
+        return self.hit_count() / count if count else 0.0
 
     def miss_count(self) -> int:
-        return self._miss_count
+        return self._sum("_miss_count")
 
     def miss_rate(self) -> float:
-        return self._miss_count / self.request_count()
+        count = self.request_count()
+        return self.miss_count() / count if count else 0.0
 
     def load_success_count(self) -> int:
-        return self._load_success_count
+        return self._sum("_load_success_count")
 
     def load_failure_count(self) -> int:
-        return self._load_failure_count
+        return self._sum("_load_failure_count")
 
     def load_failure_rate(self) -> float:
-        return self._load_failure_count / self.load_count()
+        count = self.load_count()
+        return self.load_failure_count() / count if count else 0.0
 
     def load_count(self) -> int:
-        return self._load_failure_count + self._load_success_count
+        return self.load_failure_count() + self.load_success_count()
 
     def total_load_time(self) -> int:
-        return self._total_load_time
+        return self._sum("_total_load_time")
 
     def average_load_time(self) -> float:
-        return self._total_load_time / self.load_count()
+        count = self.load_count()
+        return self.total_load_time() / count if count else 0.0
+
+    # latency of each load call, batch load is recorded once
+    def load_latency(self) -> Histogram:
+        return self._merge("_load_latency")
+
+    # latency of remote cache lookups
+    def lookup_latency(self) -> Histogram:
+        return self._merge("_lookup_latency")
+
+    # metrics of each cache layer, keyed by storage name
+    def layers(self) -> Dict[str, LayerMetrics]:
+        layers: Dict[str, LayerMetrics] = {}
+        for shard in self._shards:
+            for name, layer in list(shard._layers.items()):
+                merged = layers.get(name, None)
+                if merged is None:
+                    merged = layers[name] = LayerMetrics()
+                merged.merge(layer)
+        return layers
+
+    def layer(self, storage: str) -> LayerMetrics:
+        layer = self.layers().get(storage, None)
+        return layer if layer is not None else LayerMetrics()
+
+    # release resources, called when metrics of node are replaced
+    def close(self):
+        pass
 
 
 class CachedData(NamedTuple):
@@ -73,11 +291,25 @@ class Storage(Protocol):
     ) -> Optional[CachedData]:
         ...
 
+    # same as get, but return CachedData with expire time
+    async def get_entry(self, node: "Node", serializer: Optional["Serializer"]) -> Any:
+        ...
+
+    # local storage only
+    def get_entry_sync(self, node: "Node", serializer: Optional["Serializer"]) -> Any:
+        ...
+
     async def get_all(
         self, nodes: Sequence["Node"], serializer: Optional["Serializer"]
     ) -> Sequence[Tuple["Node", CachedData]]:
         ...
 
+    # nodes can be different types, each node use its own serializer
+    async def get_all_mixed(
+        self, nodes: Sequence["Node"]
+    ) -> Sequence[Tuple["Node", CachedData]]:
+        ...
+
     # local storage only
     def get_all_sync(
         self, nodes: Sequence["Node"], serializer: Optional["Serializer"]
@@ -96,6 +328,29 @@ class Storage(Protocol):
     async def remove(self, node: "Node"):
         ...
 
+    # write-behind set, return False if not queued
+    def set_later(
+        self,
+        node: "Node",
+        value: Any,
+        ttl: Optional[timedelta],
+        serializer: Optional["Serializer"],
+    ) -> bool:
+        ...
+
+    async def drain(self):
+        ...
+
+    def write_queue_size(self) -> int:
+        ...
+
+    def write_failure_count(self) -> int:
+        ...
+
+    # None if storage doesn't track weight
+    def weighted_size(self) -> Optional[int]:
+        ...
+
     async def set_all(
         self,
         data: Sequence[Tuple["Node", Any]],
@@ -104,6 +359,13 @@ class Storage(Protocol):
     ):
         ...
 
+    # distributed lock, used as lease before loading from source
+    async def acquire_lock(self, key: str, token: str, ttl: timedelta) -> bool:
+        ...
+
+    async def release_lock(self, key: str, token: str):
+        ...
+
     def scheme(self) -> str:
         ...
 
@@ -119,6 +381,21 @@ class Serializer(Protocol):
         ...
 
 
+class Tracer(Protocol):
+    # called when a stage starts, return value is passed to end as span
+    def start(
+        self,
+        stage: str,
+        node_cls: Type["Node"],
+        key: Optional[str],
+        storage: Optional[str],
+    ) -> Any:
+        ...
+
+    def end(self, span: Any, outcome: str, error: Optional[BaseException] = None):
+        ...
+
+
 class DoorKeeper(Protocol):
     def put(self, key: str):
         ...
@@ -157,6 +434,10 @@ class Node(Protocol[R]):
     async def load_all(cls, nodes: Sequence["Node"]) -> Sequence[Tuple["Node", Any]]:
         ...
 
+    @classmethod
+    def load_stream(cls, nodes: Sequence["Node"]) -> AsyncIterator[Tuple["Node", Any]]:
+        ...
+
     def get_version(self) -> str:
         ...
 
@@ -178,4 +459,12 @@ class Node(Protocol[R]):
         caches: List["Cache"] = []
         serializer: ClassVar[Optional[Serializer]] = None
         doorkeeper: ClassVar[Optional[DoorKeeper]] = None
+        # cache load failures for a short time, avoid hammering a failing source
+        negative_ttl: ClassVar[Optional[timedelta]] = None
+        key_fields: ClassVar[Optional[Sequence[str]]] = None
+        batch_window: ClassVar[Optional[timedelta]] = None
+        load_concurrency: ClassVar[int] = 10
+        stream_load: ClassVar[bool] = False
+        run_in_executor: ClassVar[bool] = False
+        weigher: ClassVar[Optional[Callable[[Any], int]]] = None
         metrics: ClassVar[Metrics]
@@ -0,0 +1,227 @@
+import fcntl
+import mmap
+import os
+import re
+import threading
+import weakref
+from typing import Any, Optional, Type, cast
+
+from cacheme.interfaces import Metrics, MetricsShard, Node
+
+# counters shared between processes, histograms and layer metrics stay in process
+FIELDS = (
+    "_hit_count",
+    "_miss_count",
+    "_load_success_count",
+    "_load_failure_count",
+    "_total_load_time",
+)
+# int64 header: allocated slot count
+_HEADER = 1
+# each slot: owner pid, 0 if free, then counters
+_WIDTH = 1 + len(FIELDS)
+
+
+def _counter(index: int) -> property:
+    def get(self) -> int:
+        return self._view[self._offset + index]
+
+    def set(self, value: int):
+        self._view[self._offset + index] = value
+
+    return property(get, set)
+
+
+class MmapShard(MetricsShard):
+    """
+    Shard whose counters are stored in one slot of the mapped file.
+    """
+
+    def __init__(self, view: Any, slot: int):
+        # base init zeros counters, keep counters of reused slot
+        self._view: Any = [0] * len(FIELDS)
+        self._offset = 0
+        super().__init__()
+        self._view = view
+        self.slot = slot
+        self._offset = _HEADER + slot * _WIDTH + 1
+
+    # copy counters out of file, shard keeps working after file is closed
+    def _detach(self):
+        self._view = self._view[self._offset : self._offset + len(FIELDS)].tolist()
+        self._offset = 0
+
+
+for _index, _name in enumerate(FIELDS):
+    setattr(MmapShard, _name, _counter(_index))
+
+
+def _alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class _SlotOwner:
+    """
+    Kept in thread local of owner thread, frees slot when thread exits.
+    """
+
+    def __init__(self, metrics: "MmapMetrics", slot: int):
+        self.metrics = metrics
+        self.slot = slot
+        self.pid = os.getpid()
+
+    def __del__(self):
+        # thread locals of parent process are also dropped in forked child
+        if self.pid == os.getpid():
+            self.metrics._release(self.slot)
+
+
+class MmapMetrics(Metrics):
+    """
+    Metrics with counters in a memory mapped file, processes using same file report
+    combined hit/miss/load counts. Each thread of each process takes one slot,
+    latency histograms and layer metrics are still per process. Slots of exited
+    threads and processes are reused, counters in them are kept.
+
+    :param path: file path, created if not exists.
+    :param max_shards: max slots of file, threads exceeding it count in process only.
+    """
+
+    def __init__(self, path: str, max_shards: int = 1024):
+        super().__init__()
+        self.path = path
+        self.max_shards = max_shards
+        size = (_HEADER + max_shards * _WIDTH) * 8
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            if os.fstat(self._fd).st_size < size:
+                os.ftruncate(self._fd, size)
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        self._mmap: Optional[mmap.mmap] = mmap.mmap(self._fd, size)
+        self._view: Optional[memoryview] = memoryview(self._mmap).cast("q")
+        _instances.add(self)
+
+    # shards of parent process threads are not owned by child
+    def _after_fork(self):
+        self._local = threading.local()
+        self._shards = []
+        self._lock = threading.Lock()
+
+    def _claim(self, view: memoryview) -> Optional[int]:
+        pid = os.getpid()
+        allocated = min(view[0], self.max_shards)
+        for slot in range(allocated):
+            owner = view[_HEADER + slot * _WIDTH]
+            if owner == 0 or (owner != pid and not _alive(owner)):
+                view[_HEADER + slot * _WIDTH] = pid
+                return slot
+        if allocated >= self.max_shards:
+            return None
+        view[0] = allocated + 1
+        view[_HEADER + allocated * _WIDTH] = pid
+        return allocated
+
+    def _new_shard(self) -> MetricsShard:
+        # thread lock for threads of this process, file lock for other processes
+        with self._lock:
+            view = self._view
+            if view is None:
+                return MetricsShard()
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                slot = self._claim(view)
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+        if slot is None:
+            return MetricsShard()
+        self._local.owner = _SlotOwner(self, slot)
+        return MmapShard(view, slot)
+
+    # no lock, may be called by gc at any point
+    def _release(self, slot: int):
+        view = self._view
+        if view is None:
+            return
+        try:
+            view[_HEADER + slot * _WIDTH] = 0
+        except ValueError:
+            # closed by other thread
+            pass
+
+    def close(self):
+        """
+        Free slots of this process and close file. Shards in use keep counting
+        in process, such as requests still running when metrics are replaced.
+        """
+        with self._lock:
+            view = self._view
+            if view is None:
+                return
+            for shard in self._shards:
+                if isinstance(shard, MmapShard):
+                    view[_HEADER + shard.slot * _WIDTH] = 0
+                    shard._detach()
+            self._view = None
+            view.release()
+            cast(mmap.mmap, self._mmap).close()
+            self._mmap = None
+            os.close(self._fd)
+        _instances.discard(self)
+
+    def _sum(self, name: str) -> int:
+        view = self._view
+        if view is None:
+            return super()._sum(name)
+        index = 1 + FIELDS.index(name)
+        total = sum(
+            view[_HEADER + slot * _WIDTH + index]
+            for slot in range(min(view[0], self.max_shards))
+        )
+        # shards created after file is full
+        return total + sum(
+            getattr(shard, name)
+            for shard in self._shards
+            if not isinstance(shard, MmapShard)
+        )
+
+
+_instances: "weakref.WeakSet[MmapMetrics]" = weakref.WeakSet()
+
+
+def _after_fork():
+    for metrics in list(_instances):
+        metrics._after_fork()
+
+
+os.register_at_fork(after_in_child=_after_fork)
+
+
+_invalid = re.compile(r"[^\w.\-]")
+
+
+class MmapBackend:
+    """
+    Metrics backend creating one mapped file for each node class in directory,
+    use with `set_metrics_backend`. Remove files to reset counters.
+
+    :param directory: directory of metrics files, shared by all processes.
+    :param max_shards: max slots of each file.
+    """
+
+    def __init__(self, directory: str, max_shards: int = 1024):
+        self.directory = directory
+        self.max_shards = max_shards
+
+    def __call__(self, node: Type[Node]) -> Metrics:
+        name = _invalid.sub("_", f"{node.__module__}.{node.__qualname__}")
+        return MmapMetrics(
+            os.path.join(self.directory, f"{name}.metrics"), self.max_shards
+        )
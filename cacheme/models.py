@@ -4,8 +4,9 @@ import asyncio
 from datetime import timedelta
 from time import time_ns
 from typing import (
+    AsyncIterator,
+    Callable,
     ClassVar,
-    Dict,
     Generic,
     List,
     Optional,
@@ -18,12 +19,15 @@ from typing import (
 
 from typing_extensions import Any
 
+from cacheme import data
 from cacheme.data import get_storage_by_name
 from cacheme.interfaces import DoorKeeper, Metrics, Serializer, Storage
 from cacheme.interfaces import Node as NodeP
+from cacheme.utils import to_async
 
 _nodes: List[Type[Node]] = []
 _prefix: str = "cacheme"
+_metrics_backend: Optional[Callable[[Type[Node]], Metrics]] = None
 
 sentinel = object()
 C = TypeVar("C")
@@ -34,7 +38,8 @@ def get_nodes():
 
 
 def _add_node(node: Type[Node]):
-    _nodes.append(node)
+    if node not in _nodes:
+        _nodes.append(node)
 
 
 def set_prefix(prefix: str):
@@ -42,13 +47,69 @@ def set_prefix(prefix: str):
     _prefix = prefix
 
 
-class Cache:
-    __slots__ = ["_storage", "_storage_name", "ttl", "_is_local"]
+def new_metrics(node: Type[Node]) -> Metrics:
+    if _metrics_backend is None:
+        return Metrics()
+    return _metrics_backend(node)
+
+
+def set_metrics_backend(backend: Optional[Callable[[Type[Node]], Metrics]]):
+    """
+    Set function which creates metrics of each node class, None means in-process metrics.
+    Metrics of registered nodes are replaced and closed, so call this before serving requests.
+    """
+    global _metrics_backend
+    _metrics_backend = backend
+    for node in _nodes:
+        metrics = node.Meta.metrics
+        node.Meta.metrics = new_metrics(node)
+        metrics.close()
 
-    def __init__(self, storage: str, ttl: Optional[timedelta]):
+
+class Cache:
+    __slots__ = [
+        "_storage",
+        "_storage_name",
+        "ttl",
+        "soft_ttl",
+        "stale",
+        "beta",
+        "revalidate",
+        "lease",
+        "write_behind",
+        "_is_local",
+    ]
+
+    def __init__(
+        self,
+        storage: str,
+        ttl: Optional[timedelta],
+        soft_ttl: Optional[timedelta] = None,
+        beta: Optional[float] = None,
+        lease: Optional[timedelta] = None,
+        write_behind: bool = False,
+    ):
         self._storage: Optional[Storage] = None
         self._storage_name: str = storage
         self.ttl: Optional[timedelta] = ttl
+        # data older than soft_ttl is stale: still served, but reloaded in background
+        self.soft_ttl: Optional[timedelta] = soft_ttl
+        self.stale: Optional[timedelta] = None
+        if soft_ttl is not None:
+            if ttl is None or soft_ttl >= ttl:
+                raise Exception("soft_ttl must be smaller than ttl")
+            self.stale = ttl - soft_ttl
+        # XFetch probabilistic early refresh, larger beta favors earlier refresh
+        self.beta: Optional[float] = beta
+        if beta is not None and (ttl is None or beta <= 0):
+            raise Exception("beta must be positive and ttl must be set")
+        # cached entry expire time is checked on read
+        self.revalidate: bool = self.stale is not None or beta is not None
+        # remote storage only, hold a distributed lock when loading from source,
+        # lock expires after lease, so a crashed holder won't block others forever
+        self.lease: Optional[timedelta] = lease
+        # remote storage only, fill cache in background with batched writes
+        self.write_behind: bool = write_behind
         self._is_local: Optional[bool] = None
 
     @property
@@ -64,29 +125,106 @@ class Cache:
         return cast(Storage, self._storage)
 
 
+class Plan:
+    """
+    Cache layers of a node, split by local/remote once instead of on each request.
+    Rebuilt when Meta.caches changed or a storage is registered.
+    """
+
+    __slots__ = [
+        "caches",
+        "size",
+        "version",
+        "local",
+        "remote",
+        "lease",
+        "revalidate",
+    ]
+
+    def __init__(self, caches: List[Cache]):
+        self.caches = caches
+        self.size = len(caches)
+        self.version = data._version
+        for cache in caches:
+            # storage may be registered again with same name
+            cache._storage = None
+            cache._is_local = None
+        self.local: Tuple[Cache, ...] = tuple(c for c in caches if c.is_local)
+        self.remote: Tuple[Cache, ...] = tuple(c for c in caches if not c.is_local)
+        # first remote cache with lease, used as distributed lock
+        self.lease: Optional[Cache] = next(
+            (c for c in self.remote if c.lease is not None), None
+        )
+        # local storages keep expire time of entries only if some cache revalidates
+        self.revalidate: bool = any(c.revalidate for c in caches)
+
+
+def get_plan(meta: Any) -> Plan:
+    plan = meta._plan
+    if (
+        plan is None
+        or plan.caches is not meta.caches
+        or plan.size != len(meta.caches)
+        or plan.version != data._version
+    ):
+        plan = Plan(meta.caches)
+        meta._plan = plan
+    return plan
+
+
 class MetaNode(type):
     def __new__(cls, name, bases, dct):
         new = super().__new__(cls, name, bases, dct)
+        # full key format of key_fields nodes: {prefix}:{class name}:{fields}:{version}
+        fields = getattr(new.Meta, "key_fields", None)
+        key_format = None
+        if fields and cast(Type[Node], new).key is Node.key:
+            key_format = ":".join(
+                ("{0}", name, *(f"{{1.{f}!s}}" for f in fields), "{2}")
+            )
+        setattr(new, "_key_format", key_format)
+        # sync load functions run in executor if enabled, otherwise in event loop
+        in_executor = new.Meta.run_in_executor
+        load = dct.get("load", None)
+        if callable(load):
+            setattr(new, "load", to_async(load, in_executor))
+        load_all = dct.get("load_all", None)
+        if isinstance(load_all, classmethod):
+            setattr(
+                new, "load_all", classmethod(to_async(load_all.__func__, in_executor))
+            )
         if len(new.Meta.caches) > 0:
-            _nodes.append(cast(Type[Node], cls))
-            new.Meta.metrics = Metrics()
+            _add_node(cast(Type[Node], new))
+            new.Meta.metrics = new_metrics(cast(Type[Node], new))
         return new
 
     class Meta:
         metrics: ClassVar[Metrics]
         storage: ClassVar[str] = ""
         caches: List = []
+        run_in_executor: ClassVar[bool] = False
 
 
 class Node(Generic[C], metaclass=MetaNode):
     _full_key = None
+    _key_format: ClassVar[Optional[str]] = None
 
     def key(self) -> str:
-        raise NotImplementedError()
+        fields = self.Meta.key_fields
+        if not fields:
+            raise NotImplementedError()
+        values = [str(getattr(self, f)) for f in fields]
+        return ":".join((self.__class__.__name__, *values))
 
     def full_key(self) -> str:
         if self._full_key is None:
-            self._full_key = f"{_prefix}:{self.key()}:{self.Meta.version}"
+            # key_fields nodes build full key in one format call, without key()
+            if self._key_format is not None:
+                self._full_key = self._key_format.format(
+                    _prefix, self, self.Meta.version
+                )
+            else:
+                self._full_key = f"{_prefix}:{self.key()}:{self.Meta.version}"
         return self._full_key
 
     async def load(self) -> C:
@@ -94,11 +232,30 @@ class Node(Generic[C], metaclass=MetaNode):
 
     @classmethod
     async def load_all(cls, nodes: Sequence[NodeP]) -> Sequence[Tuple[NodeP, Any]]:
-        data = []
-        for node in nodes:
-            v = await node.load()
-            data.append((node, v))
-        return data
+        return [item async for item in cls.load_stream(nodes)]
+
+    @classmethod
+    async def load_stream(
+        cls, nodes: Sequence[NodeP]
+    ) -> AsyncIterator[Tuple[NodeP, Any]]:
+        """
+        Load nodes concurrently, at most Meta.load_concurrency loads at the same time,
+        and yield each result once it's loaded.
+        """
+        semaphore = asyncio.Semaphore(cls.Meta.load_concurrency)
+
+        async def load(node: NodeP) -> Tuple[NodeP, Any]:
+            async with semaphore:
+                return node, await node.load()
+
+        tasks = [asyncio.ensure_future(load(node)) for node in nodes]
+        try:
+            for done in asyncio.as_completed(tasks):
+                yield await done
+        finally:
+            # stop pending loads if failed
+            for task in tasks:
+                task.cancel()
 
     def get_version(self) -> str:
         return self.Meta.version
@@ -121,7 +278,22 @@ class Node(Generic[C], metaclass=MetaNode):
         caches: List[Cache] = []
         serializer: ClassVar[Optional[Serializer]] = None
         doorkeeper: ClassVar[Optional[DoorKeeper]] = None
+        # cache load failures for a short time, avoid hammering a failing source
+        negative_ttl: ClassVar[Optional[timedelta]] = None
+        # build key from these attributes, instead of calling key()
+        key_fields: ClassVar[Optional[Sequence[str]]] = None
+        # collect concurrent get calls within this window, load them with one get_all
+        batch_window: ClassVar[Optional[timedelta]] = None
+        # max concurrent load calls of default load_all/load_stream
+        load_concurrency: ClassVar[int] = 10
+        # get_all use load_stream instead of load_all, deliver each result once loaded
+        stream_load: ClassVar[bool] = False
+        # run sync load/load_all and memoized functions in executor
+        run_in_executor: ClassVar[bool] = False
+        # weight of cached value in bytes, used by local storage with max_bytes
+        weigher: ClassVar[Optional[Callable[[Any], int]]] = None
         metrics: ClassVar[Metrics]
+        _plan: ClassVar[Optional[Plan]] = None
 
 
 class DynamicNode(Node):
@@ -133,8 +305,3 @@ class DynamicNode(Node):
 
     def key(self) -> str:
         return self.key_str
-
-
-class Fetcher:
-    def __init__(self):
-        self.data: Dict[str, Any] = {}
@@ -0,0 +1,59 @@
+from typing import Any, Dict, Optional, Tuple, Type
+
+try:
+    from opentelemetry import context, trace
+    from opentelemetry.trace import Span, Status, StatusCode, TracerProvider
+except ImportError as e:
+    raise ImportError(
+        "OpenTelemetryTracer requires opentelemetry-api, "
+        "install it with `pip install cacheme[opentelemetry]`"
+    ) from e
+
+from cacheme import tracing
+from cacheme.interfaces import Node
+
+
+class OpenTelemetryTracer:
+    """
+    Tracer adapter which creates an OpenTelemetry span for each stage,
+    named `cacheme.{stage}`, with node/key/storage/outcome attributes.
+    Span of get/get_all is set as current span, so stage spans are its children.
+
+    :param tracer_provider: OpenTelemetry tracer provider, default is global provider.
+    """
+
+    def __init__(self, tracer_provider: Optional[TracerProvider] = None):
+        self.tracer = trace.get_tracer("cacheme", tracer_provider=tracer_provider)
+
+    def start(
+        self,
+        stage: str,
+        node_cls: Type[Node],
+        key: Optional[str],
+        storage: Optional[str],
+    ) -> Tuple[Span, Any]:
+        attributes: Dict[str, str] = {"cacheme.node": node_cls.__name__}
+        if key is not None:
+            attributes["cacheme.key"] = key
+        if storage is not None:
+            attributes["cacheme.storage"] = storage
+        span = self.tracer.start_span(f"cacheme.{stage}", attributes=attributes)
+        token = None
+        if stage == tracing.GET:
+            token = context.attach(trace.set_span_in_context(span))
+        return span, token
+
+    def end(
+        self,
+        span: Tuple[Span, Any],
+        outcome: str,
+        error: Optional[BaseException] = None,
+    ):
+        otel_span, token = span
+        if token is not None:
+            context.detach(token)
+        otel_span.set_attribute("cacheme.outcome", outcome)
+        if error is not None:
+            otel_span.record_exception(error)
+            otel_span.set_status(Status(StatusCode.ERROR, str(error)))
+        otel_span.end()
@@ -0,0 +1,166 @@
+from random import random
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple, Type
+
+from cacheme.interfaces import Histogram, Node
+
+
+class CountMinSketch:
+    """
+    Approximate counter of keys in fixed memory, estimate is never lower than real count.
+
+    :param width: counters of each row, larger width means less overestimate.
+    :param depth: rows, each row uses a different hash.
+    """
+
+    def __init__(self, width: int = 2048, depth: int = 4):
+        self.width = width
+        self._rows = [[0] * width for _ in range(depth)]
+
+    def add(self, key: str) -> int:
+        """
+        Increase count of key, return estimated count after increase.
+        """
+        estimate = -1
+        for seed, row in enumerate(self._rows):
+            i = hash((seed, key)) % self.width
+            row[i] += 1
+            if estimate == -1 or row[i] < estimate:
+                estimate = row[i]
+        return estimate
+
+
+class TopN:
+    """
+    Keep n keys with largest values, smallest one is evicted when full.
+    """
+
+    def __init__(self, n: int):
+        self.n = n
+        self._items: Dict[str, int] = {}
+        self._min_key = ""
+        self._min = 0
+
+    def _refresh(self):
+        self._min_key = min(self._items, key=self._items.__getitem__)
+        self._min = self._items[self._min_key]
+
+    def offer(self, key: str, value: int):
+        items = self._items
+        if key in items:
+            items[key] = value
+            if key == self._min_key or value < self._min:
+                self._refresh()
+            return
+        if self.n == 0:
+            return
+        if len(items) < self.n:
+            items[key] = value
+            if len(items) == self.n:
+                self._refresh()
+            return
+        if value <= self._min:
+            return
+        items.pop(self._min_key)
+        items[key] = value
+        self._refresh()
+
+    def items(self) -> List[Tuple[str, int]]:
+        return sorted(self._items.items(), key=lambda item: item[1], reverse=True)
+
+
+class SampleReport(NamedTuple):
+    # (full key, estimated get count), most frequent first
+    hot_keys: List[Tuple[str, int]]
+    # (full key, serialized bytes), largest first
+    large_values: List[Tuple[str, int]]
+    # serialized value size histogram in bytes
+    sizes: Histogram
+
+
+class _NodeSample:
+    def __init__(self, top_k: int, large_values: int, width: int):
+        self.sketch = CountMinSketch(width)
+        self.hot_keys = TopN(top_k)
+        self.large_values = TopN(large_values)
+        self.sizes = Histogram()
+
+
+class Sampler:
+    """
+    Track hot keys and value sizes of each node. Gets are counted with a count-min sketch
+    and top k keys are kept, sizes of serialized values are recorded on remote cache set.
+
+    :param top_k: hot keys kept of each node.
+    :param large_values: largest values kept of each node.
+    :param sample_rate: probability of a get being counted, counts in report are scaled back.
+    :param width: count-min sketch width of each node.
+    """
+
+    def __init__(
+        self,
+        top_k: int = 20,
+        large_values: int = 10,
+        sample_rate: float = 1.0,
+        width: int = 2048,
+    ):
+        self.top_k = top_k
+        self.large_values = large_values
+        self.sample_rate = sample_rate
+        self.width = width
+        self._samples: Dict[Type[Node], _NodeSample] = {}
+
+    def _sample_of(self, node_cls: Type[Node]) -> _NodeSample:
+        sample = self._samples.get(node_cls, None)
+        if sample is None:
+            sample = self._samples[node_cls] = _NodeSample(
+                self.top_k, self.large_values, self.width
+            )
+        return sample
+
+    def record_get(self, node_cls: Type[Node], key: str):
+        if self.sample_rate < 1.0 and random() >= self.sample_rate:
+            return
+        sample = self._sample_of(node_cls)
+        sample.hot_keys.offer(key, sample.sketch.add(key))
+
+    def record_set(self, node_cls: Type[Node], key: str, value: Any):
+        # only serialized values have a meaningful size
+        if not isinstance(value, (bytes, bytearray, str)):
+            return
+        size = len(value)
+        sample = self._sample_of(node_cls)
+        sample.sizes.record(size)
+        sample.large_values.offer(key, size)
+
+    def report(self) -> Dict[str, SampleReport]:
+        """
+        Report of each sampled node, keyed by node class `{module}.{qualname}`.
+        """
+        reports = {}
+        for node_cls, sample in self._samples.items():
+            hot_keys = [
+                (key, int(count / self.sample_rate))
+                for key, count in sample.hot_keys.items()
+            ]
+            name = f"{node_cls.__module__}.{node_cls.__qualname__}"
+            reports[name] = SampleReport(
+                hot_keys, sample.large_values.items(), sample.sizes
+            )
+        return reports
+
+    def reset(self):
+        """
+        Clear all samples, call this periodically to forget old hot keys.
+        """
+        self._samples = {}
+
+
+_sampler: Optional[Sampler] = None
+
+
+def set_sampler(sampler: Optional[Sampler]):
+    """
+    Set sampler which tracks hot keys and value sizes. Default is None, sampling is skipped.
+    """
+    global _sampler
+    _sampler = sampler
@@ -0,0 +1,106 @@
+from asyncio import (
+    AbstractEventLoop,
+    Future,
+    TimeoutError,
+    TimerHandle,
+    get_running_loop,
+)
+from datetime import timedelta
+from time import time_ns
+from typing import Any, Dict, Optional, Tuple
+from weakref import WeakKeyDictionary
+
+
+class SingleFlight:
+    """
+    In-flight loads keyed by node full key, so concurrent gets of same key share one load.
+    Futures are bound to event loop, so each running loop has its own map.
+
+    :param max_size: max in-flight keys of each loop, new loads won't be shared when full.
+    :param timeout: fail waiters and remove key if load not finished in time,
+        the load itself is not cancelled.
+    """
+
+    def __init__(
+        self, max_size: Optional[int] = None, timeout: Optional[timedelta] = None
+    ):
+        self.max_size = max_size
+        self.timeout = timeout
+        self._loops: WeakKeyDictionary[
+            AbstractEventLoop, Dict[str, Tuple[Future, int, Optional[TimerHandle]]]
+        ] = WeakKeyDictionary()
+
+    def _flights(self) -> Dict[str, Tuple[Future, int, Optional[TimerHandle]]]:
+        loop = get_running_loop()
+        flights = self._loops.get(loop, None)
+        if flights is None:
+            flights = {}
+            self._loops[loop] = flights
+        return flights
+
+    def get(self, key: str) -> Optional[Future]:
+        item = self._flights().get(key, None)
+        return item[0] if item is not None else None
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._flights()
+
+    def start(self, key: str) -> Future:
+        """
+        Create future for key. Future is not registered if registry is full,
+        caller should still resolve and remove it as usual.
+        """
+        flights = self._flights()
+        future: Future = Future()
+        if self.max_size is not None and len(flights) >= self.max_size:
+            return future
+        handle = None
+        if self.timeout is not None:
+            handle = get_running_loop().call_later(
+                self.timeout.total_seconds(), self._expire, flights, key, future
+            )
+        flights[key] = (future, time_ns(), handle)
+        return future
+
+    def _expire(self, flights: Dict, key: str, future: Future):
+        item = flights.get(key, None)
+        if item is not None and item[0] is future:
+            flights.pop(key, None)
+        self.set_exception(future, TimeoutError(f"load timeout: {key}"))
+
+    def remove(self, key: str, future: Future):
+        flights = self._flights()
+        item = flights.get(key, None)
+        # key may be expired and taken by a new load
+        if item is None or item[0] is not future:
+            return
+        flights.pop(key, None)
+        if item[2] is not None:
+            item[2].cancel()
+
+    def set_result(self, future: Future, result: Any):
+        if not future.done():
+            future.set_result(result)
+
+    def set_exception(self, future: Future, e: BaseException):
+        if future.done():
+            return
+        future.set_exception(e)
+        # mark exception as retrieved, avoid asyncio warning if no one is waiting
+        future.exception()
+
+    def __len__(self) -> int:
+        try:
+            return len(self._flights())
+        except RuntimeError:
+            return sum(len(flights) for flights in self._loops.values())
+
+    def oldest(self) -> Optional[timedelta]:
+        """
+        Age of the oldest in-flight load of current loop, None if no load running.
+        """
+        flights = self._flights()
+        if len(flights) == 0:
+            return None
+        started = min(item[1] for item in flights.values())
+        return timedelta(microseconds=(time_ns() - started) // 1000)
@@ -6,6 +6,7 @@ from urllib.parse import urlparse
 from cacheme.interfaces import Node
 from cacheme.serializer import Serializer
 from cacheme.storages.base import BaseStorage
+from cacheme.storages.writer import BatchWriter
 
 
 class Storage:
@@ -19,7 +20,15 @@ class Storage:
         "sqlite": "cacheme.storages.sqlite:SQLiteStorage",
     }
 
-    def __init__(self, url: str, **options: Any):
+    def __init__(
+        self,
+        url: str,
+        write_batch_size: int = 100,
+        write_interval: timedelta = timedelta(milliseconds=10),
+        write_queue_size: int = 10000,
+        max_batch_size: Optional[int] = None,
+        **options: Any,
+    ):
         u = urlparse(url)
         self._scheme = u.scheme
         self._is_local = True if self._scheme == "local" else False
@@ -30,6 +39,13 @@ class Storage:
         storage_cls = self.__import(name)
         assert issubclass(storage_cls, BaseStorage)
         self._storage = storage_cls(address=url, **options)
+        if max_batch_size is not None:
+            self._storage.max_batch_size = max_batch_size
+        # write-behind queue, created on first use
+        self._writer: Optional[BatchWriter] = None
+        self._write_batch_size = write_batch_size
+        self._write_interval = write_interval
+        self._write_queue_size = write_queue_size
 
     def scheme(self) -> str:
         return self._scheme
@@ -48,11 +64,17 @@ class Storage:
     async def get(self, node: Node, serializer: Optional[Serializer]) -> Any:
         return await self._storage.get(node, serializer)
 
+    async def get_entry(self, node: Node, serializer: Optional[Serializer]) -> Any:
+        return await self._storage.get_entry(node, serializer)
+
     async def get_all(
         self, nodes: Sequence[Node], serializer: Optional[Serializer]
     ) -> Sequence[Tuple[Node, Any]]:
         return await self._storage.get_all(nodes, serializer)
 
+    async def get_all_mixed(self, nodes: Sequence[Node]) -> Sequence[Tuple[Node, Any]]:
+        return await self._storage.get_all_mixed(nodes)
+
     async def set(
         self,
         node: Node,
@@ -63,6 +85,9 @@ class Storage:
         return await self._storage.set(node, value, ttl, serializer)
 
     async def remove(self, node: Node):
+        # pending write-behind set would bring removed data back
+        if self._writer is not None:
+            await self._writer.discard(node.full_key())
         return await self._storage.remove(node)
 
     async def set_all(
@@ -73,13 +98,60 @@ class Storage:
     ):
         return await self._storage.set_all(data, ttl, serializer)
 
+    async def acquire_lock(self, key: str, token: str, ttl: timedelta) -> bool:
+        return await self._storage.acquire_lock(key, token, ttl)
+
+    async def release_lock(self, key: str, token: str):
+        return await self._storage.release_lock(key, token)
+
+    # queue set to background writer, return False if queue is full
+    def set_later(
+        self,
+        node: Node,
+        value: Any,
+        ttl: Optional[timedelta],
+        serializer: Optional[Serializer],
+    ) -> bool:
+        if self._is_local:
+            return False
+        if self._writer is None:
+            self._writer = BatchWriter(
+                self._storage,
+                batch_size=self._write_batch_size,
+                interval=self._write_interval,
+                max_size=self._write_queue_size,
+            )
+        return self._writer.put(node, value, ttl, serializer)
+
+    # write all queued sets
+    async def drain(self):
+        if self._writer is not None:
+            await self._writer.drain()
+
+    # sets waiting in write-behind queue
+    def write_queue_size(self) -> int:
+        return len(self._writer) if self._writer is not None else 0
+
+    # total weight of stored values, None if not tracked
+    def weighted_size(self) -> Optional[int]:
+        return self._storage.weighted_size() if self._is_local else None
+
+    # write-behind sets dropped because of storage errors
+    def write_failure_count(self) -> int:
+        return self._writer.failure_count if self._writer is not None else 0
+
     async def close(self):
+        await self.drain()
         return await self._storage.close()
 
     # local storage only
     def get_sync(self, node: Node, serializer: Optional[Serializer]) -> Any:
         return self._storage.get_sync(node, serializer)
 
+    # local storage only
+    def get_entry_sync(self, node: Node, serializer: Optional[Serializer]) -> Any:
+        return self._storage.get_entry_sync(node, serializer)
+
     # local storage only
     def get_all_sync(
         self, nodes: Sequence[Node], serializer: Optional[Serializer]
@@ -1,14 +1,19 @@
+from asyncio import gather
 from datetime import datetime, timedelta, timezone
-from typing import Dict, List, Optional, Sequence, Tuple, cast
+from typing import Callable, Dict, List, Optional, Sequence, Tuple, cast
 
 from typing_extensions import Any
 
+from cacheme import sampler, tracing
 from cacheme.interfaces import CachedData, Node
 from cacheme.models import sentinel
 from cacheme.serializer import Serializer
 
 
 class BaseStorage:
+    # max keys of each multi get/set, larger batch is split into chunks and executed concurrently
+    max_batch_size: int = 1000
+
     def __init__(self, address: str, *args, **kwargs):
         self.address = address
 
@@ -30,9 +35,20 @@ class BaseStorage:
     async def set_by_keys(self, data: Dict[str, Any], ttl: Optional[timedelta]):
         raise NotImplementedError()
 
+    # set key to token only if key not exists or expired, return True if success
+    async def acquire_lock(self, key: str, token: str, ttl: timedelta) -> bool:
+        raise NotImplementedError()
+
+    # remove key only if value is still token
+    async def release_lock(self, key: str, token: str):
+        raise NotImplementedError()
+
     def get_sync(self, node: Node, serializer: Optional[Serializer]) -> Any:
         raise NotImplementedError()
 
+    def get_entry_sync(self, node: Node, serializer: Optional[Serializer]) -> Any:
+        raise NotImplementedError()
+
     def get_all_sync(
         self,
         nodes: Sequence[Node],
@@ -50,17 +66,43 @@ class BaseStorage:
         )
 
     async def get(self, node: Node, serializer: Optional[Serializer]) -> Any:
-        result = await self.get_by_key(node.full_key())
-        if result is None:
-            return sentinel
-        data = self.serialize(result, serializer)
-        if data.expire is not None and data.expire.replace(
-            tzinfo=timezone.utc
-        ) <= datetime.now(timezone.utc):
+        data = await self.get_entry(node, serializer)
+        if data is sentinel:
             return sentinel
         return data.data
 
-    def deserialize(self, raw: Any, serializer: Optional[Serializer]) -> Any:
+    # return CachedData with timezone aware expire, or sentinel if missing/expired
+    async def get_entry(self, node: Node, serializer: Optional[Serializer]) -> Any:
+        result = await self.get_by_key(node.full_key())
+        if result is None:
+            return sentinel
+        tracer = tracing._tracer
+        if tracer is not None and serializer is not None:
+            data = tracing.trace_sync(
+                tracer,
+                tracing.DESERIALIZE,
+                node.__class__,
+                node.full_key(),
+                None,
+                self.serialize,
+                result,
+                serializer,
+            )
+        else:
+            data = self.serialize(result, serializer)
+        if data.expire is not None:
+            expire = data.expire.replace(tzinfo=timezone.utc)
+            if expire <= datetime.now(timezone.utc):
+                return sentinel
+            return CachedData(data=data.data, expire=expire)
+        return data
+
+    def deserialize(
+        self,
+        raw: Any,
+        serializer: Optional[Serializer],
+        ttl: Optional[timedelta] = None,
+    ) -> Any:
         if serializer is not None:
             return serializer.dumps(raw)
 
@@ -73,7 +115,23 @@ class BaseStorage:
         ttl: Optional[timedelta],
         serializer: Optional[Serializer],
     ):
-        v = self.deserialize(value, serializer)
+        tracer = tracing._tracer
+        if tracer is not None and serializer is not None:
+            v = tracing.trace_sync(
+                tracer,
+                tracing.SERIALIZE,
+                node.__class__,
+                node.full_key(),
+                None,
+                self.deserialize,
+                value,
+                serializer,
+                ttl,
+            )
+        else:
+            v = self.deserialize(value, serializer, ttl)
+        if sampler._sampler is not None:
+            sampler._sampler.record_set(node.__class__, node.full_key(), v)
         await self.set_by_key(node.full_key(), v, ttl)
 
     async def remove(self, node: Node):
@@ -83,22 +141,58 @@ class BaseStorage:
         self,
         nodes: Sequence[Node],
         serializer: Optional[Serializer],
+    ) -> Sequence[Tuple[Node, Any]]:
+        return await self._get_all(nodes, lambda node: serializer)
+
+    # nodes can be different types, each node use its own serializer
+    async def get_all_mixed(self, nodes: Sequence[Node]) -> Sequence[Tuple[Node, Any]]:
+        return await self._get_all(nodes, lambda node: node.get_seriaizer())
+
+    async def _get_all(
+        self,
+        nodes: Sequence[Node],
+        get_serializer: Callable[[Node], Optional[Serializer]],
     ) -> Sequence[Tuple[Node, Any]]:
         if len(nodes) == 0:
             return []
-        results = []
         mapping = {}
         keys = []
         for node in nodes:
             key = node.full_key()
             keys.append(key)
             mapping[key] = node
-        gets = await self.get_by_keys(keys)
+        gets: Dict[str, Any] = {}
+        for chunk in await gather(
+            *[self.get_by_keys(chunk) for chunk in self._chunks(keys)]
+        ):
+            gets.update(chunk)
+        tracer = tracing._tracer
+        if tracer is not None and len(gets) > 0:
+            return tracing.trace_sync(
+                tracer,
+                tracing.DESERIALIZE,
+                tracing.node_type(nodes),
+                None,
+                None,
+                self._decode_all,
+                gets,
+                mapping,
+                get_serializer,
+            )
+        return self._decode_all(gets, mapping, get_serializer)
+
+    def _decode_all(
+        self,
+        gets: Dict[str, Any],
+        mapping: Dict[str, Node],
+        get_serializer: Callable[[Node], Optional[Serializer]],
+    ) -> Sequence[Tuple[Node, Any]]:
+        results = []
         for k, v in gets.items():
             node = mapping[k]
             if v is None:
                 continue
-            data = self.serialize(v, serializer)
+            data = self.serialize(v, get_serializer(node))
             if data.expire is not None and data.expire.replace(
                 tzinfo=timezone.utc
             ) <= datetime.now(timezone.utc):
@@ -114,9 +208,27 @@ class BaseStorage:
     ):
         update = {}
         for node, value in data:
-            update[node.full_key()] = self.deserialize(value, serializer)
+            update[node.full_key()] = self.deserialize(value, serializer, ttl)
+        if sampler._sampler is not None:
+            for node, _ in data:
+                sampler._sampler.record_set(
+                    node.__class__, node.full_key(), update[node.full_key()]
+                )
+
+        keys = list(update.keys())
+        if len(keys) <= self.max_batch_size:
+            await self.set_by_keys(update, ttl)
+            return
+        await gather(
+            *[
+                self.set_by_keys({k: update[k] for k in chunk}, ttl)
+                for chunk in self._chunks(keys)
+            ]
+        )
 
-        await self.set_by_keys(update, ttl)
+    def _chunks(self, keys: List[str]) -> List[List[str]]:
+        size = self.max_batch_size
+        return [keys[i : i + size] for i in range(0, len(keys), size)]
 
     async def close(self):
         return
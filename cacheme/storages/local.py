@@ -1,28 +1,181 @@
-from datetime import timedelta
-from typing import Any, Optional, Sequence, Tuple
+import sys
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Optional, Sequence, Tuple
 from urllib.parse import urlparse
 
 from theine import Cache
 
-from cacheme.interfaces import Node
-from cacheme.models import sentinel
-from cacheme.serializer import Serializer
+from cacheme.interfaces import CachedData, Node
+from cacheme.models import get_plan, sentinel
+from cacheme.serializer import PickleSerializer, Serializer
 from cacheme.storages.base import BaseStorage
 
+MODES = ("object", "bytes", "memoryview")
+
+
+def _sizeof(value: Any, depth: int) -> int:
+    size = sys.getsizeof(value)
+    if depth == 0:
+        return size
+    if isinstance(value, dict):
+        size += sum(
+            _sizeof(k, depth - 1) + _sizeof(v, depth - 1) for k, v in value.items()
+        )
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        size += sum(_sizeof(v, depth - 1) for v in value)
+    elif hasattr(value, "__dict__"):
+        size += _sizeof(vars(value), depth - 1)
+    return size
+
+
+def default_weigher(value: Any) -> int:
+    """
+    Length of bytes payload, or sys.getsizeof estimate of object and its items,
+    containers are followed 3 levels deep.
+    """
+    if isinstance(value, (bytes, bytearray)):
+        return len(value)
+    if isinstance(value, memoryview):
+        return value.nbytes
+    return _sizeof(value, 3)
+
 
 class LocalStorage(BaseStorage):
-    def __init__(self, size: int, address: str, **options):
+    """
+    In-process storage backed by theine.
+
+    :param size: max entries.
+    :param mode: how values are stored. "object" stores the value itself, so callers
+        share the cached object. "bytes" stores values serialized with node serializer
+        (pickle if node has none), each get returns a new copy. "memoryview" stores
+        bytes-like values as immutable bytes, get returns read-only memoryview without copy.
+    :param max_bytes: max total weight of stored values, least recently used keys
+        are removed when exceeded. Values heavier than max_bytes are not cached.
+    :param weigher: function returns weight in bytes of stored value(serialized bytes
+        in "bytes" mode), used if node Meta.weigher is not set. Default is
+        payload length for bytes and sys.getsizeof estimate for objects.
+    """
+
+    def __init__(
+        self,
+        size: int,
+        address: str,
+        mode: str = "object",
+        max_bytes: Optional[int] = None,
+        weigher: Callable[[Any], int] = default_weigher,
+        **options,
+    ):
+        if mode not in MODES:
+            raise Exception(f"local storage mode:{mode} not found")
         policy_name = urlparse(address).netloc
         self.cache: Cache = Cache(policy_name, size)
+        self.mode = mode
+        self.max_bytes = max_bytes
+        self.weigher = weigher
+        # store and return value as is, no weight tracking
+        self._plain = mode == "object" and max_bytes is None
+        self._default_serializer = PickleSerializer()
+        # weight of each key, in access order, only tracked if max_bytes is set
+        self._sizes: "OrderedDict[str, int]" = OrderedDict()
+        self._bytes = 0
 
     async def connect(self):
         return
 
+    def _encode(self, node: Node, value: Any) -> Any:
+        if self.mode == "bytes":
+            serializer = node.get_seriaizer() or self._default_serializer
+            return serializer.dumps(value)
+        if isinstance(value, bytes):
+            return value
+        if isinstance(value, (bytearray, memoryview)):
+            return bytes(value)
+        raise Exception(
+            f"memoryview mode requires bytes-like value, get [{type(value)}]"
+        )
+
+    def _decode(self, node: Node, data: bytes) -> Any:
+        if self.mode == "bytes":
+            serializer = node.get_seriaizer() or self._default_serializer
+            return serializer.loads(data)
+        return memoryview(data)
+
+    def _get(self, node: Node) -> Any:
+        key = node.full_key()
+        entry = self.cache.get(key, sentinel)
+        if self.max_bytes is not None:
+            if entry is sentinel:
+                # expired or evicted by theine
+                self._bytes -= self._sizes.pop(key, 0)
+            elif key in self._sizes:
+                self._sizes.move_to_end(key)
+        if entry is sentinel:
+            return entry
+        if type(entry) is not CachedData:
+            entry = CachedData(data=entry)
+        if self.mode == "object":
+            return entry
+        return CachedData(data=self._decode(node, entry.data), expire=entry.expire)
+
     async def get(self, node: Node, serializer: Optional[Serializer]) -> Any:
-        return self.cache.get(node.full_key(), sentinel)
+        return self.get_sync(node, serializer)
 
     def get_sync(self, node: Node, serializer: Optional[Serializer]) -> Any:
-        return self.cache.get(node.full_key(), sentinel)
+        if not self._plain:
+            entry = self._get(node)
+            return entry if entry is sentinel else entry.data
+        entry = self.cache.get(node.full_key(), sentinel)
+        if type(entry) is CachedData:
+            return entry.data
+        return entry
+
+    async def get_entry(self, node: Node, serializer: Optional[Serializer]) -> Any:
+        return self._get(node)
+
+    def get_entry_sync(self, node: Node, serializer: Optional[Serializer]) -> Any:
+        return self._get(node)
+
+    # wrap value with expire time only if node has revalidating caches
+    def _entry(self, node: Node, value: Any, ttl: Optional[timedelta]) -> Any:
+        if ttl is None or not get_plan(node.Meta).revalidate:
+            return value
+        return CachedData(data=value, expire=datetime.now(timezone.utc) + ttl)
+
+    def _set(self, node: Node, value: Any, ttl: Optional[timedelta]):
+        key = node.full_key()
+        if self.mode != "object":
+            value = self._encode(node, value)
+        if self.max_bytes is None:
+            self.cache.set(key, self._entry(node, value, ttl), ttl)
+            return
+        weigher = node.Meta.weigher or self.weigher
+        size = weigher(value)
+        # value heavier than whole storage is not cached, old value is removed
+        if size > self.max_bytes:
+            self.cache.delete(key)
+            self._bytes -= self._sizes.pop(key, 0)
+            return
+        evicted = self.cache.set(key, self._entry(node, value, ttl), ttl)
+        if evicted is not None:
+            self._bytes -= self._sizes.pop(evicted, 0)
+        self._bytes += size - self._sizes.pop(key, 0)
+        self._sizes[key] = size
+        if self._bytes > self.max_bytes:
+            self._reconcile()
+        while self._bytes > self.max_bytes and len(self._sizes) > 1:
+            oldest, size = self._sizes.popitem(last=False)
+            self._bytes -= size
+            self.cache.delete(oldest)
+
+    # drop weight of keys expired by theine maintenance thread,
+    # tracked keys are more than cached keys only if some keys expired
+    def _reconcile(self):
+        if len(self.cache) >= len(self._sizes):
+            return
+        for key in list(self._sizes):
+            if self.cache.get(key, sentinel) is sentinel:
+                self._bytes -= self._sizes.pop(key)
 
     async def set(
         self,
@@ -31,24 +184,23 @@ class LocalStorage(BaseStorage):
         ttl: Optional[timedelta],
         serializer: Optional[Serializer],
     ):
-        self.cache.set(node.full_key(), value, ttl)
+        self._set(node, value, ttl)
 
     async def remove(self, node: Node):
-        self.cache.delete(node.full_key())
+        key = node.full_key()
+        self.cache.delete(key)
+        if self.max_bytes is not None:
+            self._bytes -= self._sizes.pop(key, 0)
 
     async def get_all(
         self,
         nodes: Sequence[Node],
         serializer: Optional[Serializer],
     ) -> Sequence[Tuple[Node, Any]]:
-        if len(nodes) == 0:
-            return []
-        results = []
-        for node in nodes:
-            v = self.cache.get(node.full_key(), sentinel)
-            if v != sentinel:
-                results.append((node, v))
-        return results
+        return self.get_all_sync(nodes, serializer)
+
+    async def get_all_mixed(self, nodes: Sequence[Node]) -> Sequence[Tuple[Node, Any]]:
+        return self.get_all_sync(nodes, None)
 
     def get_all_sync(
         self,
@@ -58,10 +210,19 @@ class LocalStorage(BaseStorage):
         if len(nodes) == 0:
             return []
         results = []
+        if not self._plain:
+            for node in nodes:
+                entry = self._get(node)
+                if entry is not sentinel:
+                    results.append((node, entry.data))
+            return results
         for node in nodes:
-            v = self.cache.get(node.full_key(), sentinel)
-            if v != sentinel:
-                results.append((node, v))
+            entry = self.cache.get(node.full_key(), sentinel)
+            if entry is sentinel:
+                continue
+            if type(entry) is CachedData:
+                entry = entry.data
+            results.append((node, entry))
         return results
 
     async def set_all(
@@ -70,5 +231,16 @@ class LocalStorage(BaseStorage):
         ttl: Optional[timedelta],
         serializer: Optional[Serializer],
     ):
+        if not self._plain:
+            for node, value in data:
+                self._set(node, value, ttl)
+            return
         for node, value in data:
-            self.cache.set(node.full_key(), value, ttl)
+            self.cache.set(node.full_key(), self._entry(node, value, ttl), ttl)
+
+    # total weight of stored values, None if max_bytes is not set
+    def weighted_size(self) -> Optional[int]:
+        if self.max_bytes is None:
+            return None
+        self._reconcile()
+        return self._bytes
@@ -3,6 +3,7 @@ from typing import Any, Dict, List, Optional
 
 import motor.motor_asyncio as mongo
 from pymongo import UpdateOne
+from pymongo.errors import DuplicateKeyError
 
 from cacheme.storages.base import BaseStorage
 
@@ -66,3 +67,19 @@ class MongoStorage(BaseStorage):
             for k, v in data.items()
         ]
         await self.table.bulk_write(requests)
+
+    async def acquire_lock(self, key: str, token: str, ttl: timedelta) -> bool:
+        now = datetime.now(timezone.utc)
+        # existing unexpired lock won't match filter, so upsert fails on unique key
+        try:
+            await self.table.update_one(
+                {"key": key, "expire": {"$lte": now}},
+                {"$set": {"value": token, "updated_at": now, "expire": now + ttl}},
+                True,
+            )
+        except DuplicateKeyError:
+            return False
+        return True
+
+    async def release_lock(self, key: str, token: str):
+        await self.table.delete_one({"key": key, "value": token})
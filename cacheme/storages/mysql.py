@@ -94,3 +94,22 @@ class MySQLStorage(SQLStorage):
                     f"delete from {self.table} where `key`=%s",
                     (key,),
                 )
+
+    async def acquire_lock(self, key: str, token: str, ttl: timedelta) -> bool:
+        now = datetime.now(timezone.utc)
+        async with self.pool.acquire() as conn:
+            async with conn.cursor() as cur:
+                # affected rows: 1 inserted, 2 updated, 0 lock still valid
+                affected = await cur.execute(
+                    f"insert into {self.table}(`key`, value, expire) values(%s,%s,%s) ON DUPLICATE KEY UPDATE value=IF(expire <= %s, VALUES(value), value), expire=IF(expire <= %s, VALUES(expire), expire)",
+                    (key, token, now + ttl, now, now),
+                )
+        return affected > 0
+
+    async def release_lock(self, key: str, token: str):
+        async with self.pool.acquire() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(
+                    f"delete from {self.table} where `key`=%s and value=%s",
+                    (key, token),
+                )
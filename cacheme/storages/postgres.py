@@ -79,3 +79,27 @@ class PostgresStorage(SQLStorage):
             raise
         async with self.pool.acquire() as conn:
             return await conn.execute(f"delete from {self.table} where key=$1", key)
+
+    async def acquire_lock(self, key: str, token: str, ttl: timedelta) -> bool:
+        if self.pool is None:
+            raise
+        now = datetime.now(timezone.utc)
+        async with self.pool.acquire() as conn:
+            status = await conn.execute(
+                f"insert into {self.table}(key, value, expire) values($1,$2,$3) on conflict(key) do update set value=EXCLUDED.value, expire=EXCLUDED.expire where {self.table}.expire <= $4",
+                key,
+                token.encode(),
+                now + ttl,
+                now,
+            )
+        return status == "INSERT 0 1"
+
+    async def release_lock(self, key: str, token: str):
+        if self.pool is None:
+            raise
+        async with self.pool.acquire() as conn:
+            await conn.execute(
+                f"delete from {self.table} where key=$1 and value=$2",
+                key,
+                token.encode(),
+            )
@@ -10,6 +10,16 @@ from cacheme.serializer import Serializer
 from cacheme.storages.base import BaseStorage
 
 
+# delete lock only if it's still owned by caller
+RELEASE_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("del", KEYS[1])
+else
+    return 0
+end
+"""
+
+
 class RedisStorage(BaseStorage):
     client: Union[redis.Redis, redis_cluster.RedisCluster]
 
@@ -47,10 +57,19 @@ class RedisStorage(BaseStorage):
         if serializer is None:
             raise Exception("serializer is None")
         data = serializer.loads(cast(bytes, raw))
-        return CachedData(data=data["value"], expire=None)
+        return CachedData(data=data["value"], expire=data.get("expire"))
 
-    def deserialize(self, raw: Any, serializer: Optional[Serializer]) -> Any:
-        value = {"value": raw, "updated_at": datetime.now(timezone.utc)}
+    def deserialize(
+        self,
+        raw: Any,
+        serializer: Optional[Serializer],
+        ttl: Optional[timedelta] = None,
+    ) -> Any:
+        now = datetime.now(timezone.utc)
+        value = {"value": raw, "updated_at": now}
+        # redis expires keys itself, expire is stored for stale checking only
+        if ttl is not None:
+            value["expire"] = now + ttl
         return super().deserialize(value, serializer)
 
     async def remove_by_key(self, key: str):
@@ -62,6 +81,15 @@ class RedisStorage(BaseStorage):
         else:
             await self.client.set(key, value)  # type: ignore
 
+    async def acquire_lock(self, key: str, token: str, ttl: timedelta) -> bool:
+        ok = await self.client.set(  # type: ignore
+            key, token, nx=True, px=int(ttl.total_seconds() * 1000)
+        )
+        return bool(ok)
+
+    async def release_lock(self, key: str, token: str):
+        await self.client.eval(RELEASE_SCRIPT, 1, key, token)  # type: ignore
+
     async def set_by_keys(self, data: Dict[str, Any], ttl: Optional[timedelta]):
         async with self.client.pipeline() as pipe:
             if ttl is not None:
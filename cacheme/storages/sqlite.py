@@ -11,6 +11,9 @@ from cacheme.storages.sqldb import SQLStorage
 
 
 class SQLiteStorage(SQLStorage):
+    # SQLITE_MAX_VARIABLE_NUMBER is 999 before SQLite 3.32.0
+    max_batch_size = 500
+
     def __init__(self, address: str, table: str, pool_size: int = 10):
         super().__init__(address, table=table)
         url = urlparse(self.address)
@@ -124,6 +127,31 @@ class SQLiteStorage(SQLStorage):
         )
         cur.close()
 
+    def sync_acquire_lock(self, key: str, token: str, ttl: timedelta) -> bool:
+        now = datetime.now(timezone.utc)
+        cur = self.writer.execute(
+            f"insert into {self.table}(key, value, expire) values(?,?,?) on conflict(key) do update set value=EXCLUDED.value, expire=EXCLUDED.expire where expire <= ?",
+            (
+                key,
+                token,
+                now + ttl,
+                now,
+            ),
+        )
+        acquired = cur.rowcount > 0
+        cur.close()
+        return acquired
+
+    def sync_release_lock(self, key: str, token: str):
+        cur = self.writer.execute(
+            f"delete from {self.table} where key=? and value=?",
+            (
+                key,
+                token,
+            ),
+        )
+        cur.close()
+
     async def get_by_key(self, key: str) -> Any:
         await self.sem.acquire()
         if sys.version_info >= (3, 9):
@@ -158,3 +186,9 @@ class SQLiteStorage(SQLStorage):
 
     async def remove_by_key(self, key: str):
         self.sync_remove_by_key(key)
+
+    async def acquire_lock(self, key: str, token: str, ttl: timedelta) -> bool:
+        return self.sync_acquire_lock(key, token, ttl)
+
+    async def release_lock(self, key: str, token: str):
+        self.sync_release_lock(key, token)
@@ -0,0 +1,127 @@
+from asyncio import Event, Task, ensure_future, gather, sleep
+from datetime import timedelta
+from typing import Any, Dict, Optional, Set, Tuple
+
+from cacheme.interfaces import Node, Serializer
+from cacheme.storages.base import BaseStorage
+
+
+class BatchWriter:
+    """
+    Write-behind queue of a storage. Pending sets are grouped by ttl and serializer,
+    and written with storage set_all(redis pipeline, sql executemany, mongo bulk_write)
+    when batch_size reached or interval elapsed.
+
+    :param storage: storage to write to.
+    :param batch_size: flush immediately when pending count reach this size.
+    :param interval: max time a pending set waits before flush.
+    :param max_size: max pending count, put will be rejected when queue is full.
+    """
+
+    def __init__(
+        self,
+        storage: BaseStorage,
+        batch_size: int = 100,
+        interval: timedelta = timedelta(milliseconds=10),
+        max_size: int = 10000,
+    ):
+        self.storage = storage
+        self.batch_size = batch_size
+        self.interval = interval.total_seconds()
+        self.max_size = max_size
+        self.failure_count = 0
+        self._pending: Dict[
+            Tuple[Optional[timedelta], Optional[Serializer]],
+            Dict[str, Tuple[Node, Any]],
+        ] = {}
+        self._size = 0
+        # keys being written by a flush, event is set when write done
+        self._writing: Dict[str, Event] = {}
+        self._timer: Optional[Task] = None
+        self._tasks: Set[Task] = set()
+
+    def __len__(self) -> int:
+        return self._size
+
+    def put(
+        self,
+        node: Node,
+        value: Any,
+        ttl: Optional[timedelta],
+        serializer: Optional[Serializer],
+    ) -> bool:
+        """
+        Queue a set, return False if queue is full and caller should set directly.
+        """
+        if self._size >= self.max_size:
+            return False
+        group = self._pending.setdefault((ttl, serializer), {})
+        key = node.full_key()
+        if key not in group:
+            self._size += 1
+        group[key] = (node, value)
+        if self._size >= self.batch_size:
+            self._spawn(self.flush())
+        elif self._timer is None:
+            self._timer = self._spawn(self._flush_later())
+        return True
+
+    def _spawn(self, coro) -> Task:
+        task = ensure_future(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    async def _flush_later(self):
+        await sleep(self.interval)
+        self._timer = None
+        await self.flush()
+
+    async def flush(self):
+        if self._size == 0:
+            return
+        pending = self._pending
+        self._pending = {}
+        self._size = 0
+        for (ttl, serializer), group in pending.items():
+            if len(group) == 0:
+                continue
+            done = Event()
+            for key in group:
+                self._writing[key] = done
+            try:
+                await self.storage.set_all(list(group.values()), ttl, serializer)
+            except Exception:
+                # cache fill is best effort, data will be loaded again on next miss
+                self.failure_count += len(group)
+            finally:
+                for key in group:
+                    if self._writing.get(key, None) is done:
+                        self._writing.pop(key)
+                done.set()
+
+    async def discard(self, key: str):
+        """
+        Drop queued set of key, and wait if key is being written,
+        so a following remove is not overwritten by this queue.
+        """
+        for group in self._pending.values():
+            if group.pop(key, None) is not None:
+                self._size -= 1
+        done = self._writing.get(key, None)
+        if done is not None:
+            await done.wait()
+
+    async def drain(self):
+        """
+        Write all pending sets and wait running flushes, call this before shutdown.
+        """
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        while True:
+            await self.flush()
+            tasks = [t for t in self._tasks if not t.done()]
+            if not tasks and self._size == 0:
+                return
+            await gather(*tasks, return_exceptions=True)
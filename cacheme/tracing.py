@@ -0,0 +1,86 @@
+from typing import Any, Awaitable, Callable, Optional, Sequence, Type
+
+from cacheme import models
+from cacheme.interfaces import Node, Tracer
+from cacheme.models import sentinel
+
+# stages
+GET = "get"  # whole get/get_all call, other stages are nested in it
+LOCAL = "local"  # local cache lookup
+SINGLEFLIGHT = "singleflight"  # wait load of same key started by others
+BATCH = "batch"  # wait batch_window load
+REMOTE = "remote"  # remote cache lookup
+LOAD = "load"  # load from source
+FILL = "fill"  # set loaded data to cache
+SERIALIZE = "serialize"
+DESERIALIZE = "deserialize"
+
+# outcomes
+HIT = "hit"
+MISS = "miss"
+OK = "ok"
+ERROR = "error"
+
+_tracer: Optional[Tracer] = None
+
+
+def set_tracer(tracer: Optional[Tracer]):
+    """
+    Set tracer which receives span start/end of each get/get_all stage.
+    Default is None, tracing code is skipped.
+    """
+    global _tracer
+    _tracer = tracer
+
+
+# node class of multi key stages, base Node class if nodes are of different types
+def node_type(nodes: Sequence[Node]) -> Type[Node]:
+    node_cls = nodes[0].__class__
+    for node in nodes:
+        if node.__class__ is not node_cls:
+            return models.Node
+    return node_cls
+
+
+# multi key stages of get_all have no key, and outcome is ok
+def _outcome(stage: str, key: Optional[str], result: Any) -> str:
+    if key is not None and (stage == LOCAL or stage == REMOTE):
+        return MISS if result is sentinel else HIT
+    return OK
+
+
+async def trace(
+    tracer: Tracer,
+    stage: str,
+    node_cls: Type[Node],
+    key: Optional[str],
+    storage: Optional[str],
+    aw: Awaitable[Any],
+) -> Any:
+    span = tracer.start(stage, node_cls, key, storage)
+    try:
+        result = await aw
+    except BaseException as e:
+        tracer.end(span, ERROR, e)
+        raise
+    tracer.end(span, _outcome(stage, key, result))
+    return result
+
+
+def trace_sync(
+    tracer: Tracer,
+    stage: str,
+    node_cls: Type[Node],
+    key: Optional[str],
+    storage: Optional[str],
+    fn: Callable[..., Any],
+    *args: Any,
+) -> Any:
+    span = tracer.start(stage, node_cls, key, storage)
+    try:
+        result = fn(*args)
+    except BaseException as e:
+        tracer.end(span, ERROR, e)
+        raise
+    tracer.end(span, _outcome(stage, key, result))
+    return result
@@ -0,0 +1,64 @@
+import asyncio
+import contextvars
+from concurrent.futures import Executor
+from functools import partial, wraps
+from inspect import isawaitable, iscoroutinefunction
+from typing import Any, Awaitable, Callable, Optional
+
+_executor: Optional[Executor] = None
+
+
+def set_executor(executor: Optional[Executor]):
+    """
+    Set executor used to run sync load functions.
+
+    :param executor: thread pool executor, None means event loop default executor.
+    """
+    global _executor
+    _executor = executor
+
+
+def to_thread(fn: Callable[..., Any]) -> Callable[..., Awaitable[Any]]:
+    """
+    Wrap sync function into async function, which runs in executor.
+    Async function is returned unchanged. If wrapped function returns an awaitable,
+    such as a decorated async function, it's awaited in event loop.
+    """
+    if iscoroutinefunction(fn):
+        return fn
+
+    @wraps(fn)
+    async def wrapper(*args, **kwargs):
+        loop = asyncio.get_running_loop()
+        ctx = contextvars.copy_context()
+        result: Any = await loop.run_in_executor(
+            _executor, partial(ctx.run, fn, *args, **kwargs)
+        )
+        if isawaitable(result):
+            return await result
+        return result
+
+    return wrapper
+
+
+def to_async(
+    fn: Callable[..., Any], in_executor: bool = False
+) -> Callable[..., Awaitable[Any]]:
+    """
+    Wrap sync function into async function, which runs in executor if in_executor
+    is True, otherwise called in event loop. Async function is returned unchanged.
+    If wrapped function returns an awaitable, it's awaited in event loop.
+    """
+    if iscoroutinefunction(fn):
+        return fn
+    if in_executor:
+        return to_thread(fn)
+
+    @wraps(fn)
+    async def wrapper(*args, **kwargs):
+        result = fn(*args, **kwargs)
+        if isawaitable(result):
+            return await result
+        return result
+
+    return wrapper
@@ -0,0 +1,32 @@
+import os
+import random
+
+import pytest_asyncio
+
+from cacheme.data import register_storage
+from cacheme.storages import Storage
+from tests.utils import setup_storage
+
+
+@pytest_asyncio.fixture
+async def sqlite_storage():
+    """
+    Factory registering a sqlite storage backed by a temporary file,
+    files are removed after test.
+    """
+    created = []
+
+    async def create(name: str = "sqlite", **options) -> Storage:
+        filename = f"test{random.randint(0, 50000)}"
+        storage = Storage(url=f"sqlite:///{filename}", table="data", **options)
+        await register_storage(name, storage)
+        await setup_storage(storage._storage)
+        created.append((storage, filename))
+        return storage
+
+    yield create
+    for storage, filename in created:
+        await storage.close()
+        for path in (filename, f"{filename}-shm", f"{filename}-wal"):
+            if os.path.exists(path):
+                os.remove(path)
@@ -1,25 +1,66 @@
-from asyncio import gather
+from asyncio import (
+    CancelledError,
+    TimeoutError,
+    ensure_future,
+    gather,
+    new_event_loop,
+    sleep,
+)
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
 from datetime import timedelta
-from unittest.mock import Mock
+from functools import wraps
+from typing import Awaitable, Dict, List, Sequence, cast
+from unittest.mock import Mock, patch
+
+import multiprocessing
+import os
+import socket
+import tempfile
+import threading
+import time
 
 import pytest
 
 from cacheme.core import (
     Memoize,
+    MemoizeAll,
     build_node,
+    drain,
     get,
     get_all,
+    get_all_nowait,
+    get_nowait,
     invalidate,
+    iter_all,
     nodes,
     refresh,
+    set_negative_cache,
+    set_singleflight,
     stats,
     _awaits_len,
+    _awaits_oldest,
+    _tasks,
 )
 from cacheme.data import register_storage
-from cacheme.models import Cache, DynamicNode, Node, sentinel, set_prefix
-from cacheme.serializer import MsgPackSerializer
+from cacheme.exporter import StatsdExporter, openmetrics
+from cacheme.interfaces import Histogram, Metrics
+from cacheme.mmap_metrics import MmapBackend, MmapMetrics
+from cacheme.models import (
+    Cache,
+    DynamicNode,
+    Node,
+    Plan,
+    get_plan,
+    sentinel,
+    set_metrics_backend,
+    set_prefix,
+)
+from cacheme.sampler import Sampler, TopN, set_sampler
+from cacheme.serializer import MsgPackSerializer, PickleSerializer
 from cacheme.storages import Storage
+from cacheme.tracing import set_tracer
+from cacheme.utils import set_executor
 
 
 def node_cls(mock: Mock):
@@ -248,6 +289,23 @@ async def test_invalidate():
     assert mock.call_count == 2
 
 
+@pytest.mark.asyncio
+async def test_fill_failure():
+    storage = Storage(url="local://tlfu", size=50)
+    await register_storage("local", storage)
+    mock = Mock()
+    Node = node_cls(mock)
+    with patch.object(storage, "set", side_effect=[Exception("fill"), None]):
+        with pytest.raises(Exception):
+            await get(Node(user_id="a", foo_id="1", level=10))
+    # failed fill doesn't leave resolved load in flight
+    assert _awaits_len() == 0
+    assert mock.call_count == 1
+    await invalidate(Node(user_id="a", foo_id="1", level=10))
+    await refresh(Node(user_id="a", foo_id="1", level=10))
+    assert mock.call_count == 2
+
+
 @pytest.mark.asyncio
 async def test_refresh():
     await register_storage("local", Storage(url="local://tlfu", size=50))
@@ -327,6 +385,8 @@ def test_nodes():
     assert len(test_nodes) > 0
     for n in test_nodes:
         assert type(n) != Node
+        assert issubclass(n, Node)
+    assert len(set(test_nodes)) == len(test_nodes)
 
 
 def test_set_prefix():
@@ -396,3 +456,1442 @@ async def test_build_node_decorator():
     result = await fn_dynamic(2)
     assert result == 2
     assert fn_dynamic_counter == 2
+
+
+@pytest.mark.asyncio
+async def test_stale_while_revalidate():
+    await register_storage("local", Storage(url="local://tlfu", size=50))
+    counter = 0
+
+    @dataclass
+    class StaleNode(Node):
+        id: str
+
+        def key(self) -> str:
+            return f"{self.id}"
+
+        async def load(self) -> int:
+            nonlocal counter
+            counter += 1
+            await sleep(0.05)
+            return counter
+
+        class Meta(Node.Meta):
+            version = "v1"
+            caches = [
+                Cache(
+                    storage="local",
+                    ttl=timedelta(seconds=10),
+                    soft_ttl=timedelta(milliseconds=100),
+                )
+            ]
+
+    assert await get(StaleNode("a")) == 1
+    assert await get(StaleNode("a")) == 1
+    await sleep(0.2)
+    # stale data returned immediately, only one reload scheduled
+    results = await gather(*[get(StaleNode("a")) for _ in range(10)])
+    assert results == [1] * 10
+    assert counter == 2
+    await sleep(0.1)
+    assert await get(StaleNode("a")) == 2
+    assert counter == 2
+    assert _awaits_len() == 0
+    metrics = stats(StaleNode)
+    assert metrics.load_success_count() == 2
+    assert metrics.miss_count() == 1
+
+    # singleflight map is full, stale data is served without refresh
+    await sleep(0.2)
+    set_singleflight(max_size=0)
+    try:
+        results = await gather(*[get(StaleNode("a")) for _ in range(50)])
+        assert results == [2] * 50
+        await sleep(0.1)
+        assert counter == 2
+    finally:
+        set_singleflight()
+
+    # get_nowait also serves stale data and schedules one refresh
+    assert get_nowait(StaleNode("a")) == 2
+    assert get_nowait(StaleNode("a")) == 2
+    await sleep(0.1)
+    assert counter == 3
+    assert get_nowait(StaleNode("a")) == 3
+
+
+def test_soft_ttl_validate():
+    with pytest.raises(Exception):
+        Cache(storage="local", ttl=None, soft_ttl=timedelta(seconds=1))
+    with pytest.raises(Exception):
+        Cache(storage="local", ttl=timedelta(seconds=1), soft_ttl=timedelta(seconds=1))
+
+
+@pytest.mark.asyncio
+async def test_early_refresh():
+    await register_storage("local", Storage(url="local://tlfu", size=50))
+    counter = 0
+
+    @dataclass
+    class XFetchNode(Node):
+        id: str
+
+        def key(self) -> str:
+            return f"{self.id}"
+
+        async def load(self) -> int:
+            nonlocal counter
+            counter += 1
+            await sleep(0.01)
+            return counter
+
+        class Meta(Node.Meta):
+            version = "v1"
+            caches = [Cache(storage="local", ttl=timedelta(seconds=10), beta=1000)]
+
+    assert await get(XFetchNode("a")) == 1
+    # pin measured load time to 10ms, real one depends on scheduling
+    XFetchNode.Meta.metrics.shard()._total_load_time = 10_000_000
+    # gap is 10s * -log(0.5), smaller than remaining ttl
+    with patch("cacheme.core.random", return_value=0.5):
+        assert await get(XFetchNode("a")) == 1
+        await sleep(0.05)
+    assert counter == 1
+    # gap is 10s * -log(0.1), refresh early
+    with patch("cacheme.core.random", return_value=0.9):
+        results = await gather(*[get(XFetchNode("a")) for _ in range(10)])
+        assert results == [1] * 10
+        await sleep(0.05)
+    assert counter == 2
+    XFetchNode.Meta.metrics.shard()._total_load_time = 20_000_000
+    with patch("cacheme.core.random", return_value=0.5):
+        assert await get(XFetchNode("a")) == 2
+    assert _awaits_len() == 0
+
+
+# node cached in sqlite storage, options are passed to sqlite Cache
+def sqlite_node_cls(mock: Mock, name: str, serializer=None, local=True, **options):
+    @dataclass
+    class SqliteNode(Node):
+        id: str
+
+        def key(self) -> str:
+            return f"{name}:{self.id}"
+
+        async def load(self) -> str:
+            mock(name)
+            return f"{name}-{self.id}"
+
+        class Meta(Node.Meta):
+            version = "v1"
+            caches = [Cache(storage="sqlite", ttl=None, **options)]
+
+    if local:
+        SqliteNode.Meta.caches.insert(0, Cache(storage="local", ttl=None))
+    SqliteNode.Meta.serializer = serializer
+    return SqliteNode
+
+
+@pytest.mark.asyncio
+async def test_lease(sqlite_storage):
+    storage = await sqlite_storage()
+    mock = Mock()
+    LeaseNode = sqlite_node_cls(
+        mock, "lease", local=False, lease=timedelta(milliseconds=500)
+    )
+
+    # lease hold by another process, which fill data later
+    node = LeaseNode("a")
+    assert await storage.acquire_lock(
+        f"{node.full_key()}:lock", "other", timedelta(seconds=5)
+    )
+
+    async def fill():
+        await sleep(0.1)
+        await storage.set(node, "filled", None, None)
+        await storage.release_lock(f"{node.full_key()}:lock", "other")
+
+    result, _ = await gather(get(LeaseNode("a")), fill())
+    assert result == "filled"
+    assert mock.call_count == 0
+
+    # lease holder crashed, load after lease expired
+    node = LeaseNode("b")
+    await storage.acquire_lock(
+        f"{node.full_key()}:lock", "other", timedelta(milliseconds=300)
+    )
+    assert await get(LeaseNode("b")) == "lease-b"
+    assert mock.call_count == 1
+    # lock released after load
+    assert await storage.acquire_lock(
+        f"{node.full_key()}:lock", "other", timedelta(seconds=1)
+    )
+    assert await storage.get(node, None) == "lease-b"
+
+
+@pytest.mark.asyncio
+async def test_load_failure():
+    await register_storage("local", Storage(url="local://tlfu", size=50))
+    mock = Mock()
+
+    @dataclass
+    class FailNode(Node):
+        id: str
+
+        def key(self) -> str:
+            return f"fail:{self.id}"
+
+        async def load(self) -> str:
+            mock()
+            await sleep(0.05)
+            raise ValueError(self.id)
+
+        class Meta(Node.Meta):
+            version = "v1"
+            caches = [Cache(storage="local", ttl=None)]
+
+    # concurrent waiters get same exception, instead of waiting forever
+    results = await gather(
+        *[get(FailNode("a")) for _ in range(10)], return_exceptions=True
+    )
+    assert all(isinstance(r, ValueError) for r in results)
+    assert mock.call_count == 1
+    assert _awaits_len() == 0
+
+    mock.reset_mock()
+    batch_results = await gather(
+        get_all([FailNode("b"), FailNode("c")]),
+        get_all([FailNode("b"), FailNode("c")]),
+        get(FailNode("b")),
+        return_exceptions=True,
+    )
+    assert all(isinstance(r, ValueError) for r in batch_results)
+    # default load_all loads concurrently, both loads called
+    assert mock.call_count == 2
+    assert _awaits_len() == 0
+
+
+@pytest.mark.asyncio
+async def test_get_all_wait_failure():
+    await register_storage("local", Storage(url="local://tlfu", size=50))
+    mock = Mock()
+
+    @dataclass
+    class WaitNode(Node):
+        id: str
+
+        def key(self) -> str:
+            return f"wait:{self.id}"
+
+        async def load(self) -> str:
+            mock(self.id)
+            await sleep(0.05)
+            if self.id == "fail":
+                raise ValueError(self.id)
+            return self.id
+
+        class Meta(Node.Meta):
+            version = "v1"
+            caches = [Cache(storage="local", ttl=None)]
+
+    # get_all loads ok, and waits fail which is loaded by get
+    results = await gather(
+        get(WaitNode("fail")),
+        get_all([WaitNode("fail"), WaitNode("ok")]),
+        return_exceptions=True,
+    )
+    assert all(isinstance(r, ValueError) for r in results)
+    assert _awaits_len() == 0
+    # ok is not cached, load again instead of reusing resolved future
+    assert await get(WaitNode("ok")) == "ok"
+    assert [c.args[0] for c in mock.call_args_list].count("ok") == 2
+
+
+def negative_node_cls(mock: Mock):
+    @dataclass
+    class NegativeNode(Node):
+        id: str
+
+        def key(self) -> str:
+            return f"negative:{self.id}"
+
+        async def load(self) -> str:
+            mock()
+            raise ValueError(self.id)
+
+        class Meta(Node.Meta):
+            version = "v1"
+            caches = [Cache(storage="local", ttl=None)]
+            negative_ttl = timedelta(milliseconds=200)
+
+    return NegativeNode
+
+
+@pytest.mark.asyncio
+async def test_negative_cache():
+    await register_storage("local", Storage(url="local://tlfu", size=50))
+    mock = Mock()
+    NegativeNode = negative_node_cls(mock)
+
+    errors: List[BaseException] = []
+    for _ in range(5):
+        with pytest.raises(ValueError) as info:
+            await get(NegativeNode("a"))
+        errors.append(info.value)
+    assert mock.call_count == 1
+    # each caller gets a new exception chained from the cached one
+    assert len({id(e) for e in errors}) == 5
+    assert all(e.__cause__ is errors[0] for e in errors[1:])
+    for _ in range(5):
+        with pytest.raises(ValueError):
+            await get_all([NegativeNode("a"), NegativeNode("b")])
+    assert mock.call_count == 1
+    await sleep(0.3)
+    with pytest.raises(ValueError):
+        await get(NegativeNode("a"))
+    assert mock.call_count == 2
+    # invalidate also clear negative cache
+    await invalidate(NegativeNode("a"))
+    with pytest.raises(ValueError):
+        await get(NegativeNode("a"))
+    assert mock.call_count == 3
+
+    # cache is cleared when full
+    set_negative_cache(max_size=1)
+    try:
+        for key in ["c", "d", "c"]:
+            with pytest.raises(ValueError):
+                await get(NegativeNode(key))
+        assert mock.call_count == 6
+    finally:
+        set_negative_cache()
+
+
+@pytest.mark.asyncio
+async def test_write_behind(sqlite_storage):
+    storage = await sqlite_storage(
+        write_batch_size=5, write_interval=timedelta(milliseconds=50)
+    )
+    set_all = Mock(wraps=storage._storage.set_all)
+    storage._storage.set_all = set_all  # type: ignore
+    WriteNode = sqlite_node_cls(Mock(), "write", local=False, write_behind=True)
+
+    assert await get(WriteNode("a")) == "write-a"
+    assert await storage.get(WriteNode("a"), None) is sentinel
+    await sleep(0.1)
+    assert await storage.get(WriteNode("a"), None) == "write-a"
+    assert set_all.call_count == 1
+
+    # flush when batch size reached
+    assert await get_all([WriteNode(f"{i}") for i in range(3)]) == [
+        "write-0",
+        "write-1",
+        "write-2",
+    ]
+    await gather(*[get(WriteNode(f"{i}")) for i in range(3, 5)])
+    await sleep(0)
+    assert set_all.call_count == 2
+    for i in range(5):
+        assert await storage.get(WriteNode(f"{i}"), None) == f"write-{i}"
+
+    # drain on shutdown
+    assert await get(WriteNode("b")) == "write-b"
+    await drain()
+    assert await storage.get(WriteNode("b"), None) == "write-b"
+    assert set_all.call_count == 3
+
+    # invalidate drops pending write
+    assert await get(WriteNode("c")) == "write-c"
+    await invalidate(WriteNode("c"))
+    await sleep(0.1)
+    assert await storage.get(WriteNode("c"), None) is sentinel
+    assert set_all.call_count == 3
+
+
+@pytest.mark.asyncio
+async def test_cache_plan():
+    await register_storage("local", Storage(url="local://tlfu", size=50))
+    mock = Mock()
+    FooNode = node_cls(mock)
+    plan = get_plan(FooNode.Meta)
+    assert get_plan(FooNode.Meta) is plan
+    assert plan.local == tuple(FooNode.Meta.caches)
+    assert plan.remote == ()
+    await get(FooNode(user_id="a", foo_id="1", level=1))
+    await get(FooNode(user_id="a", foo_id="1", level=1))
+    assert mock.call_count == 1
+
+    # register storage again, plan rebuilt and new storage used
+    await register_storage("local", Storage(url="local://tlfu", size=50))
+    assert get_plan(FooNode.Meta) is not plan
+    await get(FooNode(user_id="a", foo_id="1", level=1))
+    assert mock.call_count == 2
+
+    # caches changed
+    plan = get_plan(FooNode.Meta)
+    FooNode.Meta.caches = [Cache(storage="local", ttl=None)]
+    assert get_plan(FooNode.Meta) is not plan
+    assert get_plan(FooNode.Meta).local == tuple(FooNode.Meta.caches)
+
+
+@pytest.mark.asyncio
+async def test_get_nowait():
+    await register_storage("local", Storage(url="local://tlfu", size=50))
+    mock = Mock()
+    FooNode = node_cls(mock)
+    node = FooNode(user_id="a", foo_id="1", level=1)
+    assert get_nowait(node) is sentinel
+    assert get_nowait(node, None) is None
+    assert mock.call_count == 0
+    assert stats(FooNode).miss_count() == 2
+    await get(node)
+    assert get_nowait(node) == "a-1-1"
+    assert get_nowait(FooNode(user_id="a", foo_id="1", level=1)) == "a-1-1"
+    assert mock.call_count == 1
+
+    nodes = [
+        FooNode(user_id="a", foo_id="1", level=1),
+        FooNode(user_id="b", foo_id="1", level=1),
+    ]
+    assert get_all_nowait(nodes) == ["a-1-1", sentinel]
+    assert get_all_nowait(nodes, None) == ["a-1-1", None]
+    await get_all(nodes)
+    assert get_all_nowait(nodes) == ["a-1-1", "b-1-1"]
+    assert get_all_nowait([]) == []
+    assert mock.call_count == 2
+    assert stats(FooNode).hit_count() == 7
+
+
+def key_fields_node_cls():
+    @dataclass
+    class KeyNode(Node):
+        user_id: int
+        name: str
+
+        class Meta(Node.Meta):
+            version = "v2"
+            key_fields = ["user_id", "name"]
+
+    return KeyNode
+
+
+def test_key_fields():
+    set_prefix("youcache")
+    KeyNode = key_fields_node_cls()
+    node = KeyNode(user_id=1, name="a{b}")
+    assert node.key() == "KeyNode:1:a{b}"
+    assert node.full_key() == "youcache:KeyNode:1:a{b}:v2"
+    mock = Mock()
+    FooNode = node_multi_cls(mock)
+    assert FooNode(id="1").full_key() == "youcache:1:v1"
+    set_prefix("mycache")
+    assert KeyNode(user_id=1, name="a").full_key() == "mycache:KeyNode:1:a:v2"
+    assert FooNode(id="1").full_key() == "mycache:1:v1"
+    set_prefix("youcache")
+    FooNode.Meta.version = "v3"
+    assert FooNode(id="1").full_key() == "youcache:1:v3"
+    KeyNode.Meta.version = "v3"
+    assert KeyNode(user_id=2, name="b").full_key() == "youcache:KeyNode:2:b:v3"
+
+    # custom key method wins over key_fields
+    @dataclass
+    class CustomNode(Node):
+        user_id: int
+
+        def key(self) -> str:
+            return f"custom:{self.user_id}"
+
+        class Meta(Node.Meta):
+            version = "v1"
+            key_fields = ["user_id"]
+
+    assert CustomNode(user_id=1).full_key() == "youcache:custom:1:v1"
+
+
+@pytest.mark.asyncio
+async def test_singleflight():
+    await register_storage("local", Storage(url="local://tlfu", size=50))
+    mock = Mock()
+    FooNode = node_cls(mock)
+
+    async def slow_load(node) -> str:
+        mock()
+        await sleep(0.2)
+        return f"slow-{node.user_id}"
+
+    # introspection
+    assert _awaits_oldest() is None
+    task = gather(*[get(FooNode("a", "1", 1), slow_load) for _ in range(3)])
+    await sleep(0.05)
+    assert _awaits_len() == 1
+    oldest = _awaits_oldest()
+    assert oldest is not None and oldest >= timedelta(milliseconds=40)
+    assert await task == ["slow-a"] * 3
+    assert mock.call_count == 1
+    assert _awaits_len() == 0
+
+    try:
+        # waiters fail after timeout, leader still get the result
+        set_singleflight(timeout=timedelta(milliseconds=50))
+        mock.reset_mock()
+        results = await gather(
+            *[get(FooNode("b", "1", 1), slow_load) for _ in range(3)],
+            return_exceptions=True,
+        )
+        assert results[0] == "slow-b"
+        assert all(isinstance(r, TimeoutError) for r in results[1:])
+        assert mock.call_count == 1
+        assert _awaits_len() == 0
+
+        # loads exceeding max size are not shared
+        set_singleflight(max_size=1)
+        mock.reset_mock()
+        assert await gather(
+            get(FooNode("c", "1", 1), slow_load),
+            get(FooNode("d", "1", 1), slow_load),
+            get(FooNode("d", "1", 1), slow_load),
+        ) == ["slow-c", "slow-d", "slow-d"]
+        assert mock.call_count == 3
+        assert _awaits_len() == 0
+    finally:
+        set_singleflight()
+
+
+@pytest.mark.asyncio
+async def test_singleflight_multiple_loops():
+    await register_storage("local", Storage(url="local://tlfu", size=50))
+    mock = Mock()
+    FooNode = node_cls(mock)
+
+    async def slow_load(node) -> str:
+        mock()
+        await sleep(0.1)
+        return "slow"
+
+    thread_results = []
+
+    def run():
+        loop = new_event_loop()
+        thread_results.append(
+            loop.run_until_complete(get(FooNode("a", "1", 1), slow_load))
+        )
+        loop.close()
+
+    # same key loading in another loop, future can't be shared
+    thread = threading.Thread(target=run)
+    task = get(FooNode("a", "1", 1), slow_load)
+    thread.start()
+    assert await task == "slow"
+    thread.join()
+    assert thread_results == ["slow"]
+    assert mock.call_count == 2
+    assert _awaits_len() == 0
+
+
+def batch_node_cls(mock: Mock):
+    @dataclass
+    class BatchNode(Node):
+        id: str
+
+        def key(self) -> str:
+            return f"batch:{self.id}"
+
+        async def load(self) -> str:
+            raise Exception("load should not be called")
+
+        @classmethod
+        async def load_all(cls, nodes):
+            mock(len(nodes))
+            if any(node.id == "fail" for node in nodes):
+                raise ValueError("fail")
+            return [(node, f"{node.id}-loaded") for node in nodes]
+
+        class Meta(Node.Meta):
+            version = "v1"
+            caches = [
+                Cache(storage="local", ttl=None),
+                Cache(storage="sqlite", ttl=None),
+            ]
+            batch_window = timedelta(milliseconds=5)
+
+    return BatchNode
+
+
+@pytest.mark.asyncio
+async def test_batch_window(sqlite_storage):
+    storage = await sqlite_storage()
+    await register_storage("local", Storage(url="local://tlfu", size=50))
+    mock = Mock()
+
+    BatchNode = batch_node_cls(mock)
+
+    await storage.set(BatchNode("a"), "a-cached", None, None)
+    with patch.object(
+        storage, "get_all_mixed", wraps=storage.get_all_mixed
+    ) as get_all_mock:
+        results = await gather(
+            *[get(BatchNode(id)) for id in ["a", "b", "c", "b", "a"]],
+            get_all([BatchNode("c"), BatchNode("d")]),
+        )
+    assert results == [
+        "a-cached",
+        "b-loaded",
+        "c-loaded",
+        "b-loaded",
+        "a-cached",
+        ["c-loaded", "d-loaded"],
+    ]
+    # one remote round trip for all single gets, get_all waits batched c
+    assert get_all_mock.call_count == 2
+    assert mock.call_count == 2
+    assert sorted(c.args[0] for c in mock.call_args_list) == [1, 2]
+    assert _awaits_len() == 0
+    # local and remote caches filled
+    assert get_nowait(BatchNode("b")) == "b-loaded"
+    assert await storage.get(BatchNode("c"), None) == "c-loaded"
+
+    # whole batch fails together
+    mock.reset_mock()
+    errors = await gather(
+        get(BatchNode("fail")), get(BatchNode("e")), return_exceptions=True
+    )
+    assert all(isinstance(r, ValueError) for r in errors)
+    assert mock.call_count == 1
+    assert _awaits_len() == 0
+
+    # batch task cancelled, waiters are cancelled too
+    task = ensure_future(get(BatchNode("f")))
+    await sleep(0)
+    for t in list(_tasks):
+        if getattr(t.get_coro(), "__name__", None) == "_load_batch":
+            t.cancel()
+    with pytest.raises(CancelledError):
+        await task
+    assert _awaits_len() == 0
+
+
+@pytest.mark.asyncio
+async def test_get_all_mixed(sqlite_storage):
+    storage = await sqlite_storage()
+    await register_storage("local", Storage(url="local://tlfu", size=50))
+    mock = Mock()
+    UserNode = sqlite_node_cls(mock, "user", MsgPackSerializer())
+    ProfileNode = sqlite_node_cls(mock, "profile", PickleSerializer())
+    await storage.set(ProfileNode("1"), "profile-cached", None, PickleSerializer())
+    nodes = [UserNode("1"), ProfileNode("1"), UserNode("2"), ProfileNode("2")]
+    with patch.object(
+        storage, "get_all_mixed", wraps=storage.get_all_mixed
+    ) as get_all_mock:
+        results = await get_all(nodes + [UserNode("1")])
+    assert results == [
+        "user-1",
+        "profile-cached",
+        "user-2",
+        "profile-2",
+        "user-1",
+    ]
+    # one multi get for both types
+    assert get_all_mock.call_count == 1
+    assert sorted(c.args[0] for c in mock.call_args_list) == [
+        "profile",
+        "user",
+        "user",
+    ]
+    assert stats(UserNode).miss_count() == 2
+    assert stats(UserNode).hit_count() == 1
+    assert stats(ProfileNode).miss_count() == 2
+    assert _awaits_len() == 0
+
+    # filled with each type serializer
+    assert await storage.get(UserNode("2"), MsgPackSerializer()) == "user-2"
+    assert await storage.get(ProfileNode("2"), PickleSerializer()) == "profile-2"
+    mock.reset_mock()
+    assert await get_all(nodes) == results[:4]
+    assert mock.call_count == 0
+
+
+def concurrent_node_cls(mock: Mock):
+    @dataclass
+    class ConcurrentNode(Node):
+        id: str
+        running = 0
+        max_running = 0
+
+        def key(self) -> str:
+            return f"concurrent:{self.id}"
+
+        async def load(self) -> str:
+            cls = self.__class__
+            cls.running += 1
+            cls.max_running = max(cls.max_running, cls.running)
+            await sleep(0.3 if self.id == "slow" else 0.01)
+            cls.running -= 1
+            mock(self.id)
+            return self.id
+
+        class Meta(Node.Meta):
+            version = "v1"
+            caches = [Cache(storage="local", ttl=None)]
+            load_concurrency = 2
+
+    return ConcurrentNode
+
+
+@pytest.mark.asyncio
+async def test_load_concurrency():
+    await register_storage("local", Storage(url="local://tlfu", size=50))
+    mock = Mock()
+    ConcurrentNode = concurrent_node_cls(mock)
+    ids = [f"{i}" for i in range(6)]
+    assert await get_all([ConcurrentNode(id) for id in ids]) == ids
+    assert ConcurrentNode.max_running == 2
+    assert mock.call_count == 6
+
+
+@pytest.mark.asyncio
+async def test_stream_load():
+    await register_storage("local", Storage(url="local://tlfu", size=50))
+    mock = Mock()
+    ConcurrentNode = concurrent_node_cls(mock)
+    ConcurrentNode.Meta.stream_load = True
+    finished = []
+
+    async def get_all_nodes():
+        result = await get_all([ConcurrentNode("slow"), ConcurrentNode("fast")])
+        finished.append("get_all")
+        return result
+
+    async def get_fast():
+        await sleep(0.001)
+        result = await get(ConcurrentNode("fast"))
+        finished.append("get")
+        return result
+
+    assert await gather(get_all_nodes(), get_fast()) == [["slow", "fast"], "fast"]
+    # waiter of fast key get result before slow key loaded
+    assert finished == ["get", "get_all"]
+    assert mock.call_count == 2
+    assert _awaits_len() == 0
+
+
+@pytest.mark.asyncio
+async def test_stream_load_close():
+    await register_storage("local", Storage(url="local://tlfu", size=50))
+    closed = []
+    streams = []
+
+    @dataclass
+    class StreamNode(Node):
+        id: str
+
+        def key(self) -> str:
+            return f"stream:{self.id}"
+
+        @classmethod
+        def load_stream(cls, nodes):
+            async def stream():
+                try:
+                    yield "bad", 1
+                    for node in nodes:
+                        yield node, node.id
+                finally:
+                    closed.append(True)
+
+            # keep a reference, so generator is not closed by garbage collection
+            streams.append(stream())
+            return streams[-1]
+
+        class Meta(Node.Meta):
+            version = "v1"
+            caches = [Cache(storage="local", ttl=None)]
+            stream_load = True
+
+    # consumer fails on bad item, generator is closed right away
+    with pytest.raises(AttributeError):
+        await get_all([StreamNode("a"), StreamNode("b")])
+    assert closed == [True]
+    assert _awaits_len() == 0
+
+
+@pytest.mark.asyncio
+async def test_iter_all():
+    mock = Mock()
+    FooNode = node_multi_cls(mock)
+    await register_storage("local1", Storage(url="local://tlfu", size=50))
+    await register_storage("local2", Storage(url="local://tlfu", size=50))
+    nodes = [FooNode(id=f"{i}") for i in range(25)]
+
+    with patch("cacheme.core.get_all", wraps=get_all) as get_all_mock:
+        results = [item async for item in iter_all(nodes, window=10)]
+    assert [node for node, _ in results] == nodes
+    assert all(value == "test" for _, value in results)
+    assert [len(c.args[0]) for c in get_all_mock.call_args_list] == [10, 10, 5]
+    assert mock.call_count == 25
+
+    async def agen():
+        for node in nodes:
+            yield node
+
+    results = [item async for item in iter_all(agen(), window=10)]
+    assert [node for node, _ in results] == nodes
+    assert mock.call_count == 25
+
+
+@pytest.mark.asyncio
+async def test_memoize_node_cache():
+    await register_storage("local", Storage(url="local://tlfu", size=50))
+    mock = Mock()
+    to_node_mock = Mock()
+    FooNode = node_cls(mock)
+    test_fn = Memoize(FooNode, node_cache_size=2)(fn)
+
+    @test_fn.to_node
+    def _(a, b, m):
+        to_node_mock()
+        return FooNode(user_id=str(a), foo_id=str(b), level=10)
+
+    assert await test_fn(1, "2", mock) == "1/2/apple"
+    assert await test_fn(1, "2", mock) == "1/2/apple"
+    assert mock.call_count == 1
+    assert to_node_mock.call_count == 1
+    assert stats(FooNode).hit_count() == 1
+    # kwargs
+    assert await test_fn(a=1, b="2", m=mock) == "1/2/apple"
+    assert await test_fn(a=1, b="2", m=mock) == "1/2/apple"
+    assert to_node_mock.call_count == 2
+    # unhashable args are not cached
+    assert await test_fn(1, ["2"], mock) == "1/['2']/apple"
+    assert await test_fn(1, ["2"], mock) == "1/['2']/apple"
+    assert to_node_mock.call_count == 4
+    # full, cleared
+    assert await test_fn(2, "2", mock) == "2/2/apple"
+    assert await test_fn(1, "2", mock) == "1/2/apple"
+    assert to_node_mock.call_count == 6
+    assert mock.call_count == 3
+    # prefix changed, nodes rebuilt
+    set_prefix("mycache")
+    try:
+        assert await test_fn(1, "2", mock) == "1/2/apple"
+        assert to_node_mock.call_count == 7
+        assert mock.call_count == 4
+    finally:
+        set_prefix("youcache")
+
+
+@pytest.mark.asyncio
+async def test_memoize_all():
+    await register_storage("local", Storage(url="local://tlfu", size=50))
+    mock = Mock()
+    FooNode = node_cls(mock)
+
+    @MemoizeAll(FooNode)
+    async def get_users(ids, level: int):
+        mock(list(ids))
+        return {i: f"user-{i}-{level}" for i in ids if i != "missing"}
+
+    @get_users.to_node
+    def _(i, level: int):
+        return FooNode(user_id=i, foo_id="bulk", level=level)
+
+    assert await get_users(["a", "b"], 1) == {"a": "user-a-1", "b": "user-b-1"}
+    assert mock.call_args_list[-1].args == (["a", "b"],)
+    # only missing ids are loaded, results follow input order
+    assert await get_users(["c", "b", "missing", "a"], level=1) == {
+        "c": "user-c-1",
+        "b": "user-b-1",
+        "missing": None,
+        "a": "user-a-1",
+    }
+    assert mock.call_args_list[-1].args == (["c", "missing"],)
+    # missing ids are not cached, loaded again
+    assert await get_users(["missing", "a"], 1) == {"missing": None, "a": "user-a-1"}
+    assert mock.call_args_list[-1].args == (["missing"],)
+    assert mock.call_count == 3
+    assert await get_users([], 1) == {}
+    assert mock.call_count == 3
+
+
+def sync_node_cls(mock: Mock):
+    @dataclass
+    class SyncNode(Node):
+        id: str
+
+        def key(self) -> str:
+            return f"sync:{self.id}"
+
+        def load(self):
+            mock(threading.get_ident())
+            time.sleep(0.1)
+            return f"sync-{self.id}"
+
+        class Meta(Node.Meta):
+            version = "v1"
+            caches = [Cache(storage="local", ttl=None)]
+            run_in_executor = True
+
+    return SyncNode
+
+
+def decorated_node_cls(mock: Mock, offload: bool):
+    # sync decorator returning coroutine of async function
+    def traced(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            mock(threading.get_ident())
+            return fn(*args, **kwargs)
+
+        return wrapper
+
+    @dataclass
+    class DecoratedNode(Node):
+        id: str
+
+        def key(self) -> str:
+            return f"decorated:{self.id}"
+
+        @traced
+        async def load(self):
+            await sleep(0.01)
+            return f"decorated-{self.id}"
+
+        class Meta(Node.Meta):
+            version = "v1"
+            caches = [Cache(storage="local", ttl=None)]
+            run_in_executor = offload
+
+    return DecoratedNode
+
+
+@pytest.mark.asyncio
+async def test_sync_load():
+    await register_storage("local", Storage(url="local://tlfu", size=50))
+    mock = Mock()
+    SyncNode = sync_node_cls(mock)
+    executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="cacheme-test")
+    set_executor(executor)
+    try:
+        start = time.time()
+        results = await gather(
+            *[get(SyncNode("a")) for _ in range(10)],
+            get_all([SyncNode("b"), SyncNode("c"), SyncNode("d")]),
+        )
+        # loads run in threads concurrently, only once for each key
+        assert time.time() - start < 0.3
+        assert results[:10] == ["sync-a"] * 10
+        assert results[10] == ["sync-b", "sync-c", "sync-d"]
+        assert mock.call_count == 4
+        assert threading.get_ident() not in [c.args[0] for c in mock.call_args_list]
+
+        def fn_sync(a: int, b: str, m: Mock) -> str:
+            m(threading.current_thread().name)
+            return f"{a}/{b}/sync"
+
+        mock.reset_mock()
+        test_fn = Memoize(SyncNode)(fn_sync)
+        test_fn.to_node(lambda a, b, m: SyncNode(id=f"memoize-{a}-{b}"))
+        results = await gather(*[test_fn(1, "2", mock) for _ in range(5)])
+        assert results == ["1/2/sync"] * 5
+        assert mock.call_count == 1
+        assert mock.call_args.args[0].startswith("cacheme-test")
+    finally:
+        set_executor(None)
+        executor.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_sync_load_inline():
+    await register_storage("local", Storage(url="local://tlfu", size=50))
+    mock = Mock()
+    DecoratedNode = decorated_node_cls(mock, False)
+
+    # sync functions run in event loop without run_in_executor
+    def fn_sync(a: int, m: Mock) -> int:
+        m(threading.get_ident())
+        return a * 2
+
+    test_fn = Memoize(DecoratedNode)(fn_sync)
+    test_fn.to_node(lambda a, m: DecoratedNode(id=f"inline-{a}"))
+    assert await test_fn(2, mock) == 4
+    assert await test_fn(2, mock) == 4
+    assert mock.call_count == 1
+    assert mock.call_args.args[0] == threading.get_ident()
+
+    def fn_all_sync(ids: Sequence[int], m: Mock) -> Dict[int, int]:
+        m(threading.get_ident())
+        return {i: i * 2 for i in ids}
+
+    mock.reset_mock()
+    test_all = MemoizeAll(DecoratedNode)(fn_all_sync)
+    test_all.to_node(lambda i, m: DecoratedNode(id=f"inline-all-{i}"))
+    assert await test_all([1, 2], mock) == {1: 2, 2: 4}
+    assert mock.call_args.args[0] == threading.get_ident()
+
+    @dataclass
+    class InlineNode(Node):
+        id: str
+
+        def key(self) -> str:
+            return f"inline:{self.id}"
+
+        def load(self):
+            mock(threading.get_ident())
+            return f"inline-{self.id}"
+
+        class Meta(Node.Meta):
+            version = "v1"
+            caches = [Cache(storage="local", ttl=None)]
+
+    mock.reset_mock()
+    assert await get(InlineNode("a")) == "inline-a"
+    assert await get_all([InlineNode("b")]) == ["inline-b"]
+    assert mock.call_args.args[0] == threading.get_ident()
+
+
+@pytest.mark.parametrize("run_in_executor", [False, True])
+@pytest.mark.asyncio
+async def test_decorated_async_load(run_in_executor: bool):
+    await register_storage("local", Storage(url="local://tlfu", size=50))
+    mock = Mock()
+    DecoratedNode = decorated_node_cls(mock, run_in_executor)
+    result = await get(DecoratedNode("a"))
+    assert result == "decorated-a"
+    assert mock.call_count == 1
+    # decorator runs in event loop thread unless offload is enabled
+    assert (mock.call_args.args[0] == threading.get_ident()) is not run_in_executor
+
+    def fn(a: int) -> Awaitable[str]:
+        async def inner() -> str:
+            return f"{a}/decorated"
+
+        return inner()
+
+    test_fn = Memoize(DecoratedNode)(fn)
+    test_fn.to_node(lambda a: DecoratedNode(id=f"memoize-{a}"))
+    assert await test_fn(1) == "1/decorated"
+    assert await test_fn(1) == "1/decorated"
+
+
+def test_histogram():
+    histogram = Histogram()
+    assert histogram.percentile(50) == 0
+    for i in range(1, 1001):
+        histogram.record(i * 1000)
+    assert histogram.count() == 1000
+    assert histogram.max() == 1000000
+    assert histogram.mean() == 500500
+    # bucket relative error is at most 12.5%
+    for p in [1, 50, 90, 99]:
+        assert abs(histogram.percentile(p) - p * 10000) <= p * 10000 * 0.125
+    assert histogram.percentile(100) == 1000000
+    histogram.record(1 << 50)
+    assert histogram.max() == 1 << 50
+
+
+@pytest.mark.asyncio
+async def test_layer_metrics(sqlite_storage):
+    storage = await sqlite_storage()
+    await register_storage("local", Storage(url="local://tlfu", size=50))
+    mock = Mock()
+    MixedNode = sqlite_node_cls(mock, "layer", None)
+    await storage.set(MixedNode("remote"), "remote-cached", None, None)
+    assert await get(MixedNode("a")) == "layer-a"
+    assert await get(MixedNode("a")) == "layer-a"
+    assert await get(MixedNode("remote")) == "remote-cached"
+    assert await get_all([MixedNode("a"), MixedNode("b"), MixedNode("c")]) == [
+        "layer-a",
+        "layer-b",
+        "layer-c",
+    ]
+    metrics = stats(MixedNode)
+    local = metrics.layers()["local"]
+    remote = metrics.layers()["sqlite"]
+    # a, a, remote, [a, b, c]
+    assert local.hit_count() == 2
+    assert local.miss_count() == 4
+    assert remote.hit_count() == 1
+    assert remote.miss_count() == 3
+    # a, remote, get_all
+    assert remote.get_latency().count() == 3
+    assert metrics.lookup_latency().count() == 3
+    # a, get_all
+    assert remote.set_latency().count() == 2
+    # get counts remote hit as load, same as total_load_time
+    assert metrics.load_latency().count() == 3
+    assert metrics.load_latency().total() == metrics.total_load_time()
+    assert metrics.load_latency().percentile(99) > 0
+
+
+def test_empty_metrics():
+    metrics = Metrics()
+    assert metrics.hit_rate() == 0
+    assert metrics.miss_rate() == 0
+    assert metrics.load_failure_rate() == 0
+    assert metrics.average_load_time() == 0
+    assert metrics.layer("local").hit_rate() == 0
+
+    # layers resolved again if plan local caches changed
+    plan = Plan([])
+    shard = metrics.shard()
+    assert shard.local_layers(plan) == ()
+    plan.local = (Cache(storage="local", ttl=None),)
+    assert len(shard.local_layers(plan)) == 1
+
+
+def exporter_node_cls():
+    @dataclass
+    class ExporterNode(Node):
+        id: str
+
+        def key(self) -> str:
+            return f"exporter:{self.id}"
+
+        async def load(self) -> str:
+            return self.id
+
+        class Meta(Node.Meta):
+            version = "v1"
+            caches = [Cache(storage="local", ttl=None)]
+
+    return ExporterNode
+
+
+def _receive(sock: socket.socket):
+    lines = []
+    sock.settimeout(1)
+    while True:
+        try:
+            lines += sock.recv(65535).decode().split("\n")
+        except socket.timeout:
+            return lines
+        sock.settimeout(0.05)
+
+
+@pytest.mark.asyncio
+async def test_exporter():
+    await register_storage("local", Storage(url="local://tlfu", size=50))
+    ExporterNode = exporter_node_cls()
+    assert await get(ExporterNode("a")) == "a"
+    assert await get(ExporterNode("a")) == "a"
+    name = "tests.test_core.exporter_node_cls.<locals>.ExporterNode"
+    statsd_name = "tests_test_core_exporter_node_cls__locals__ExporterNode"
+    text = openmetrics()
+    assert text.endswith("# EOF\n")
+    assert "# TYPE cacheme_hits counter" in text
+    assert 'cacheme_hits_total{node="' + name + '"} 1\n' in text
+    assert 'cacheme_misses_total{node="' + name + '"} 1\n' in text
+    assert 'cacheme_layer_hits_total{node="' + name + '",storage="local"} 1\n' in text
+    assert "# TYPE cacheme_load_latency_seconds summary" in text
+    assert 'cacheme_load_latency_seconds_count{node="' + name + '"} 1\n' in text
+    assert 'cacheme_storage_write_queue{storage="local"} 0\n' in text
+    # weight is tracked only with max_bytes
+    assert 'cacheme_storage_weighted_size_bytes{storage="local"}' not in text
+    await register_storage(
+        "weighted", Storage(url="local://tlfu", size=50, max_bytes=100)
+    )
+    text = openmetrics()
+    assert 'cacheme_storage_weighted_size_bytes{storage="weighted"} 0\n' in text
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(("127.0.0.1", 0))
+    exporter = StatsdExporter(
+        port=sock.getsockname()[1], interval=timedelta(milliseconds=10)
+    )
+    exporter.push()
+    lines = _receive(sock)
+    assert f"cacheme.node.{statsd_name}.hits:1|c" in lines
+    assert f"cacheme.node.{statsd_name}.misses:1|c" in lines
+    assert f"cacheme.node.{statsd_name}.load_latency.count:1|c" in lines
+    assert "cacheme.storage.local.write_queue:0|g" in lines
+    assert any(
+        line.startswith(f"cacheme.node.{statsd_name}.load_latency.p99:")
+        for line in lines
+    )
+    # only deltas are sent
+    assert await get(ExporterNode("a")) == "a"
+    exporter.start()
+    await sleep(0.05)
+    await exporter.stop()
+    lines = _receive(sock)
+    assert f"cacheme.node.{statsd_name}.hits:1|c" in lines
+    assert not any(
+        line.startswith(f"cacheme.node.{statsd_name}.misses:") for line in lines
+    )
+    sock.close()
+
+
+class RecordTracer:
+    def __init__(self):
+        self.spans = []
+
+    def start(self, stage, node_cls, key, storage):
+        span = {"stage": stage, "node": node_cls, "key": key, "storage": storage}
+        self.spans.append(span)
+        return span
+
+    def end(self, span, outcome, error=None):
+        span["outcome"] = outcome
+        span["error"] = error
+
+    def pop(self):
+        spans = [
+            (span["stage"], span["storage"], span.get("outcome")) for span in self.spans
+        ]
+        self.spans = []
+        return spans
+
+
+@pytest.mark.asyncio
+async def test_tracing(sqlite_storage):
+    storage = await sqlite_storage()
+    await register_storage("local", Storage(url="local://tlfu", size=50))
+    TraceNode = sqlite_node_cls(Mock(), "trace", PickleSerializer())
+    await storage.set(TraceNode("remote"), "remote-cached", None, PickleSerializer())
+    tracer = RecordTracer()
+    set_tracer(tracer)
+    try:
+        assert await get(TraceNode("a")) == "trace-a"
+        assert tracer.spans[0]["node"] == TraceNode
+        assert tracer.spans[0]["key"] == TraceNode("a").full_key()
+        assert tracer.pop() == [
+            ("get", None, "ok"),
+            ("local", "local", "miss"),
+            ("remote", "sqlite", "miss"),
+            ("load", None, "ok"),
+            ("fill", "local", "ok"),
+            ("fill", "sqlite", "ok"),
+            ("serialize", None, "ok"),
+        ]
+        assert await get(TraceNode("a")) == "trace-a"
+        assert tracer.pop() == [("get", None, "ok"), ("local", "local", "hit")]
+        assert await get(TraceNode("remote")) == "remote-cached"
+        assert tracer.pop() == [
+            ("get", None, "ok"),
+            ("local", "local", "miss"),
+            ("remote", "sqlite", "hit"),
+            ("deserialize", None, "ok"),
+            ("fill", "local", "ok"),
+        ]
+        assert tracer.spans == []
+        await gather(get(TraceNode("b")), get(TraceNode("b")))
+        assert ("singleflight", None, "ok") in tracer.pop()
+
+        async def fail(node):
+            raise ValueError("fail")
+
+        with pytest.raises(ValueError):
+            await get(TraceNode("c"), fail)
+        spans = tracer.spans
+        assert spans[-1]["stage"] == "load"
+        assert spans[-1]["outcome"] == "error"
+        assert isinstance(spans[-1]["error"], ValueError)
+        assert (spans[0]["stage"], spans[0]["outcome"]) == ("get", "error")
+        tracer.pop()
+
+        await get_all([TraceNode("a"), TraceNode("d")])
+        assert tracer.spans[0]["key"] is None
+        assert tracer.pop() == [
+            ("get", None, "ok"),
+            ("local", "local", "ok"),
+            ("remote", "sqlite", "ok"),
+            ("load", None, "ok"),
+            ("fill", "local", "ok"),
+            ("fill", "sqlite", "ok"),
+        ]
+
+        # remote hits are deserialized in one span, mixed types get span has base Node
+        OtherNode = sqlite_node_cls(Mock(), "trace-other", PickleSerializer())
+        await storage.set(TraceNode("remote-b"), "b", None, PickleSerializer())
+        tracer.pop()
+        await get_all([TraceNode("remote-b"), OtherNode("a")])
+        assert tracer.spans[0]["node"] is Node
+        assert ("deserialize", None, "ok") in tracer.pop()
+    finally:
+        set_tracer(None)
+
+
+@pytest.mark.asyncio
+async def test_tracing_opentelemetry():
+    pytest.importorskip("opentelemetry.sdk")
+    from opentelemetry.sdk.trace import TracerProvider
+    from opentelemetry.sdk.trace.export import SimpleSpanProcessor
+    from opentelemetry.sdk.trace.export.in_memory_span_exporter import (
+        InMemorySpanExporter,
+    )
+
+    from cacheme.otel import OpenTelemetryTracer
+
+    exporter = InMemorySpanExporter()
+    provider = TracerProvider()
+    provider.add_span_processor(SimpleSpanProcessor(exporter))
+    await register_storage("local", Storage(url="local://tlfu", size=50))
+    ExporterNode = exporter_node_cls()
+    set_tracer(OpenTelemetryTracer(tracer_provider=provider))
+    try:
+        with provider.get_tracer("test").start_as_current_span("request") as request:
+            assert await get(ExporterNode("otel")) == "otel"
+
+        async def fail(node):
+            raise ValueError("fail")
+
+        with pytest.raises(ValueError):
+            await get(ExporterNode("otel-fail"), fail)
+    finally:
+        set_tracer(None)
+    spans = exporter.get_finished_spans()
+    assert [span.name for span in spans] == [
+        "cacheme.local",
+        "cacheme.load",
+        "cacheme.fill",
+        "cacheme.get",
+        "request",
+        "cacheme.local",
+        "cacheme.load",
+        "cacheme.get",
+    ]
+    # stage spans are nested in get span, get span is nested in current span
+    parents = [getattr(span.parent, "span_id", None) for span in spans]
+    ids = [getattr(span.context, "span_id", None) for span in spans]
+    assert parents[3] == request.get_span_context().span_id
+    assert parents[:3] == [ids[3]] * 3
+    assert parents[5:] == [ids[7], ids[7], None]
+    assert dict(spans[0].attributes or {}) == {
+        "cacheme.node": "ExporterNode",
+        "cacheme.key": ExporterNode("otel").full_key(),
+        "cacheme.storage": "local",
+        "cacheme.outcome": "miss",
+    }
+    assert (spans[-2].attributes or {})["cacheme.outcome"] == "error"
+    assert not spans[-2].status.is_ok
+    assert spans[-2].events[0].name == "exception"
+    assert (spans[-1].attributes or {})["cacheme.outcome"] == "error"
+
+
+def test_top_n():
+    top = TopN(2)
+    top.offer("a", 1)
+    top.offer("b", 5)
+    top.offer("c", 1)
+    assert top.items() == [("b", 5), ("a", 1)]
+    top.offer("c", 3)
+    assert top.items() == [("b", 5), ("c", 3)]
+    top.offer("b", 2)
+    top.offer("d", 4)
+    assert top.items() == [("d", 4), ("c", 3)]
+
+
+@pytest.mark.asyncio
+async def test_sampler(sqlite_storage):
+    storage = await sqlite_storage()
+    await register_storage("local", Storage(url="local://tlfu", size=50))
+    SampleNode = sqlite_node_cls(Mock(), "sample", PickleSerializer())
+    sampler = Sampler(top_k=2, large_values=1)
+    set_sampler(sampler)
+    try:
+        for _ in range(10):
+            await get(SampleNode("hot"))
+        for _ in range(3):
+            await get(SampleNode("warm"))
+        await get_all([SampleNode(str(i)) for i in range(5)] + [SampleNode("warm")])
+        await get(SampleNode("large" * 100))
+    finally:
+        set_sampler(None)
+    report = sampler.report()["tests.test_core.sqlite_node_cls.<locals>.SqliteNode"]
+    assert report.hot_keys == [
+        (SampleNode("hot").full_key(), 10),
+        (SampleNode("warm").full_key(), 4),
+    ]
+    # hot, warm, 0-4, large
+    assert report.sizes.count() == 8
+    assert report.large_values[0][0] == SampleNode("large" * 100).full_key()
+    assert report.large_values[0][1] == report.sizes.max()
+    sampler.reset()
+    assert sampler.report() == {}
+
+
+def _count_hits(metrics: Metrics, n: int):
+    for _ in range(n):
+        shard = metrics.shard()
+        shard._hit_count += 1
+        shard._load_latency.record(100)
+
+
+def test_metrics_threads():
+    metrics = Metrics()
+    threads = [
+        threading.Thread(target=_count_hits, args=(metrics, 10000)) for _ in range(4)
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert metrics.hit_count() == 40000
+    assert metrics.load_latency().count() == 40000
+    assert len(metrics._shards) == 4
+
+
+def test_mmap_metrics():
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "node.metrics")
+        metrics = MmapMetrics(path, max_shards=8)
+        _count_hits(metrics, 10)
+        ctx = multiprocessing.get_context("fork")
+        processes = [
+            ctx.Process(target=_count_hits, args=(metrics, 1000)) for _ in range(3)
+        ]
+        for p in processes:
+            p.start()
+        for p in processes:
+            p.join()
+        assert metrics.hit_count() == 3010
+        # histograms are per process
+        assert metrics.load_latency().count() == 10
+        # another process opening same file
+        other = MmapMetrics(path, max_shards=8)
+        assert other.hit_count() == 3010
+        # slots of exited processes and threads are reused, counters are kept
+        for _ in range(5):
+            t = threading.Thread(target=_count_hits, args=(other, 1))
+            t.start()
+            t.join()
+        assert metrics.hit_count() == 3015
+        assert other.hit_count() == 3015
+        assert cast(memoryview, other._view)[0] <= 4
+        # closed metrics count in process only
+        metrics.close()
+        metrics.close()
+        _count_hits(metrics, 1)
+        assert metrics.hit_count() == 11
+        assert other.hit_count() == 3015
+        other.close()
+
+        # slots are full, count in process only
+        full = MmapMetrics(os.path.join(directory, "full.metrics"), max_shards=1)
+        _count_hits(full, 1)
+        t = threading.Thread(target=_count_hits, args=(full, 1))
+        t.start()
+        t.join()
+        assert full.hit_count() == 2
+        assert MmapMetrics(full.path, max_shards=1).hit_count() == 1
+
+
+@pytest.mark.asyncio
+async def test_metrics_backend():
+    await register_storage("local", Storage(url="local://tlfu", size=50))
+    ExporterNode = exporter_node_cls()
+    with tempfile.TemporaryDirectory() as directory:
+        set_metrics_backend(MmapBackend(directory))
+        try:
+            assert isinstance(stats(ExporterNode), MmapMetrics)
+            assert await get(ExporterNode("mmap")) == "mmap"
+            assert await get(ExporterNode("mmap")) == "mmap"
+            metrics = MmapBackend(directory)(ExporterNode)
+            assert metrics.hit_count() == 1
+            assert metrics.miss_count() == 1
+            assert metrics.load_success_count() == 1
+            replaced = stats(ExporterNode)
+        finally:
+            set_metrics_backend(None)
+        # replaced metrics are closed
+        assert cast(MmapMetrics, replaced)._view is None
+    assert type(stats(ExporterNode)) is Metrics
+    assert stats(ExporterNode).request_count() == 0
@@ -9,7 +9,7 @@ import pytest
 
 from cacheme.models import Node, sentinel
 from cacheme.serializer import PickleSerializer
-from cacheme.storages.local import LocalStorage
+from cacheme.storages.local import LocalStorage, default_weigher
 from cacheme.storages.mongo import MongoStorage
 from cacheme.storages.mysql import MySQLStorage
 from cacheme.storages.postgres import PostgresStorage
@@ -34,6 +34,10 @@ class FooNode(Node):
     "storage",
     [
         {"s": LocalStorage(200, "local://tlfu"), "local": True},
+        {
+            "s": LocalStorage(200, "local://tlfu", mode="bytes", max_bytes=100000),
+            "local": True,
+        },
         {
             "s": SQLiteStorage(
                 f"sqlite:///test{random.randint(0, 50000)}",
@@ -91,6 +95,13 @@ async def test_storages(storage):
     result = await s.get(node, serializer=PickleSerializer())
     assert result is not None
     assert result == {"foo": "bar"}
+    entry = await s.get_entry(node, serializer=PickleSerializer())
+    assert entry.data == {"foo": "bar"}
+    if isinstance(s, LocalStorage):
+        # expire time is kept only for nodes with soft_ttl/beta caches
+        assert entry.expire is None
+    else:
+        assert entry.expire is not None
 
     # expire test
     node = FooNode(id="foo_expire")
@@ -124,6 +135,15 @@ async def test_storages(storage):
         "bar-2",
     }
 
+    # large batch split into chunks
+    s.max_batch_size = 7
+    data = [(FooNode(id=f"chunk-{i}"), f"bar-{i}") for i in range(20)]
+    await s.set_all(data, ttl=timedelta(seconds=10), serializer=PickleSerializer())
+    result = await s.get_all(
+        [node for node, _ in data] + [FooNode(id="chunk-foo")], PickleSerializer()
+    )
+    assert sorted(r[1] for r in result) == sorted(v for _, v in data)
+
     # invalidate
     node = FooNode(id="invalidate")
     await s.set(
@@ -138,7 +158,140 @@ async def test_storages(storage):
     result = await s.get(node, serializer=PickleSerializer())
     assert result == sentinel
 
+    # distributed lock
+    if not isinstance(s, LocalStorage):
+        assert await s.acquire_lock("foo:lock", "a", timedelta(seconds=1)) is True
+        assert await s.acquire_lock("foo:lock", "b", timedelta(seconds=1)) is False
+        # release by others is ignored
+        await s.release_lock("foo:lock", "b")
+        assert await s.acquire_lock("foo:lock", "b", timedelta(seconds=1)) is False
+        await s.release_lock("foo:lock", "a")
+        assert await s.acquire_lock("foo:lock", "b", timedelta(seconds=1)) is True
+        # lock expired
+        await sleep(1.5)
+        assert await s.acquire_lock("foo:lock", "a", timedelta(seconds=1)) is True
+        await s.release_lock("foo:lock", "a")
+
     if filename != "":
         os.remove(filename)
         os.remove(f"{filename}-shm")
         os.remove(f"{filename}-wal")
+
+
+# wait theine maintenance thread removing expired keys
+async def _wait_expired(s: LocalStorage, size: int):
+    for _ in range(100):
+        if len(s.cache) == size:
+            return
+        await sleep(0.1)
+    assert len(s.cache) == size
+
+
+@pytest.mark.asyncio
+async def test_local_storage_modes():
+    with pytest.raises(Exception):
+        LocalStorage(10, "local://lru", mode="foo")
+
+    # copy on read
+    s = LocalStorage(10, "local://lru", mode="bytes")
+    node = FooNode(id="foo")
+    await s.set(node, {"foo": ["bar"]}, None, None)
+    result = s.get_sync(node, None)
+    result["foo"].append("baz")
+    assert s.get_sync(node, None) == {"foo": ["bar"]}
+    assert (await s.get_all([node], None))[0][1] == {"foo": ["bar"]}
+
+    # zero copy
+    s = LocalStorage(10, "local://lru", mode="memoryview")
+    await s.set(node, bytearray(b"foo"), None, None)
+    view = s.get_sync(node, None)
+    assert isinstance(view, memoryview)
+    assert view.readonly
+    assert view == b"foo"
+    assert s.get_sync(node, None).obj is view.obj
+    with pytest.raises(Exception):
+        await s.set(node, "foo", None, None)
+
+    # capacity in bytes, least recently used removed first
+    s = LocalStorage(100, "local://lru", mode="memoryview", max_bytes=25)
+    for i in range(3):
+        await s.set(FooNode(id=f"{i}"), b"x" * 10, None, None)
+    assert s.get_sync(FooNode(id="0"), None) is sentinel
+    assert s.weighted_size() == 20
+    assert s.get_sync(FooNode(id="1"), None) == b"x" * 10
+    await s.set(FooNode(id="3"), b"x" * 5, None, None)
+    assert s.weighted_size() == 25
+    await s.set(FooNode(id="4"), b"x", None, None)
+    assert s.get_sync(FooNode(id="2"), None) is sentinel
+    assert s.get_sync(FooNode(id="1"), None) == b"x" * 10
+    assert s.weighted_size() == 16
+    await s.remove(FooNode(id="1"))
+    assert s.weighted_size() == 6
+
+    # keys expired by theine are not counted
+    s = LocalStorage(100, "local://tlfu", mode="memoryview", max_bytes=25)
+    await s.set(FooNode(id="0"), b"x" * 10, None, None)
+    for i in range(1, 3):
+        await s.set(FooNode(id=f"{i}"), b"x" * 5, timedelta(seconds=1), None)
+    assert s.weighted_size() == 20
+    await _wait_expired(s, 1)
+    assert s.weighted_size() == 10
+    # expired keys are removed before evicting live ones
+    for i in range(3, 5):
+        await s.set(FooNode(id=f"{i}"), b"x" * 5, timedelta(seconds=1), None)
+    await _wait_expired(s, 1)
+    await s.set(FooNode(id="5"), b"x" * 15, None, None)
+    assert s.get_sync(FooNode(id="0"), None) == b"x" * 10
+    assert s.weighted_size() == 25
+
+    # value heavier than max_bytes is not cached, old value is removed
+    await s.set(FooNode(id="0"), b"x" * 26, None, None)
+    assert s.get_sync(FooNode(id="0"), None) is sentinel
+    assert s.get_sync(FooNode(id="5"), None) == b"x" * 15
+    assert s.weighted_size() == 15
+    # weight not tracked without max_bytes
+    assert LocalStorage(10, "local://lru").weighted_size() is None
+
+
+def weighted_node_cls():
+    @dataclass
+    class WeightedNode(Node):
+        id: str
+
+        def key(self) -> str:
+            return f"{self.id}"
+
+        class Meta(Node.Meta):
+            version = "v1"
+            weigher = len
+
+    return WeightedNode
+
+
+@pytest.mark.asyncio
+async def test_local_storage_weigher():
+    assert default_weigher(b"x" * 10) == 10
+    assert default_weigher(memoryview(b"x" * 10)) == 10
+    assert default_weigher({"foo": "x" * 100}) > 100
+    assert default_weigher(["x" * 100, "y" * 100]) > 200
+
+    # object mode, default weigher
+    s = LocalStorage(100, "local://lru", max_bytes=1000)
+    await s.set(FooNode(id="0"), "x" * 400, None, None)
+    await s.set(FooNode(id="1"), ["x" * 400], None, None)
+    assert (s.weighted_size() or 0) > 800
+    await s.set(FooNode(id="2"), "x" * 10, None, None)
+    assert s.get_sync(FooNode(id="0"), None) is sentinel
+    assert s.get_sync(FooNode(id="1"), None) == ["x" * 400]
+    size = s.weighted_size()
+    assert size is not None and size <= 1000
+
+    # storage weigher and node weigher
+    WeightedNode = weighted_node_cls()
+    s = LocalStorage(100, "local://lru", max_bytes=10, weigher=lambda v: 4)
+    await s.set(FooNode(id="0"), "foo", None, None)
+    await s.set(WeightedNode(id="1"), "foo", None, None)
+    assert s.weighted_size() == 7
+    await s.set(FooNode(id="2"), "foo", None, None)
+    assert s.get_sync(FooNode(id="0"), None) is sentinel
+    assert s.weighted_size() == 7